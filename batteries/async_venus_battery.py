@@ -0,0 +1,140 @@
+import time
+from pymodbus.client import AsyncModbusTcpClient
+from batteries.venus_battery import (
+    REG_SOC, REG_POWER, REG_CHARGE_SETPOINT, REG_DISCHARGE_SETPOINT, REG_SET_FORCED_DISCHARGE,
+    REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL, BATTERY_MODBUS_CONTROL_RELEASE,
+    CONTROL_BLOCK_START, CONTROL_BLOCK_COUNT,
+)
+from utils.logger import get_logger
+
+
+class AsyncVenusBattery:
+    """
+    asyncio driver for a Venus battery, used by fleet mode. It talks to the
+    same registers as VenusBattery but is driven by a site: read_state() before
+    the control cycle and apply() with the commands the controller issued.
+    """
+
+    def __init__(self, ip: str, unit_id: int = 1, name: str = "Venus", port: int = 502, reconcile_interval: int = 60):
+        self.ip = ip
+        self.unit_id = unit_id
+        self.port = port
+        self.name = name
+        self.client = AsyncModbusTcpClient(host=ip, port=port)
+        self.retry_backoff = 1
+        self.next_connect_attempt = 0
+        self.last_written_values = {}  # register_address -> value
+        self.released = False
+        self.reconcile_interval = reconcile_interval
+        self.last_reconcile = time.time()
+        self.drift_events = 0
+        self.logger = get_logger('AsyncVenusBattery')
+
+    async def _connect(self) -> bool:
+        if self.client.connected:
+            return True
+        now = time.time()
+        if now < self.next_connect_attempt:
+            return False
+        try:
+            connected = await self.client.connect()
+        except Exception as e:
+            self.logger.error(f"[{self.name}] Exception while connecting: {e}")
+            connected = False
+        if connected:
+            self.retry_backoff = 1
+            self.logger.info(f"[{self.name}] Connected to battery at {self.ip}")
+        else:
+            self.retry_backoff = min(self.retry_backoff * 2, 10)
+            self.next_connect_attempt = now + self.retry_backoff
+        return connected
+
+    async def _read(self, address: int, count: int = 1) -> list[int] | None:
+        if not await self._connect():
+            return None
+        try:
+            result = await self.client.read_holding_registers(address=address, count=count, device_id=self.unit_id)
+        except Exception as e:
+            self.logger.error(f"[{self.name}] Exception during read at {address}: {e}")
+            return None
+        if result.isError() or not result.registers or len(result.registers) < count:
+            self.logger.warning(f"[{self.name}] Failed Modbus read at {address}")
+            return None
+        return result.registers
+
+    async def _write_if_changed(self, address: int, value: int) -> None:
+        if self.last_written_values.get(address) == value or not await self._connect():
+            return
+        try:
+            result = await self.client.write_register(address=address, value=value, device_id=self.unit_id)
+        except Exception as e:
+            self.logger.error(f"[{self.name}] Exception writing {value} to register {address}: {e}")
+            return
+        if result.isError():
+            self.logger.warning(f"[{self.name}] Failed to write {value} to register {address}")
+            return
+        self.last_written_values[address] = value
+
+    async def read_state(self) -> tuple[float, int]:
+        """Return (SoC %, power W). Raises when the battery cannot be read."""
+        if not self.released and time.time() - self.last_reconcile > self.reconcile_interval:
+            self.last_reconcile = time.time()
+            await self._reconcile_control_block()
+        soc = await self._read(REG_SOC)
+        power = await self._read(REG_POWER, count=2)
+        if soc is None or power is None:
+            raise Exception(f"[{self.name}] Failed to read battery state")
+        raw = (power[0] << 16) | power[1]
+        if raw & 0x80000000:
+            raw -= 0x100000000
+        return soc[0], raw
+
+    async def read_energy(self) -> tuple[float, float]:
+        """Return the total (charged, discharged) energy in kWh."""
+        registers = await self._read(33000, count=4)
+        if registers is None:
+            raise Exception(f"[{self.name}] Failed to read energy counters")
+        return ((registers[0] << 16) | registers[1]) / 100, ((registers[2] << 16) | registers[3]) / 100
+
+    async def _reconcile_control_block(self) -> None:
+        registers = await self._read(CONTROL_BLOCK_START, count=CONTROL_BLOCK_COUNT)
+        if registers is None:
+            return
+        expected = {address: value for address, value in self.last_written_values.items()
+                    if CONTROL_BLOCK_START <= address < CONTROL_BLOCK_START + CONTROL_BLOCK_COUNT}
+        expected[REG_RS484_CONTROL_MODE] = BATTERY_MODBUS_CONTROL
+        for address, value in expected.items():
+            actual = registers[address - CONTROL_BLOCK_START]
+            if actual != value:
+                self.drift_events += 1
+                self.logger.warning(f"[{self.name}] Register {address} drifted to {actual} (expected {value}). Rewriting.")
+                self.last_written_values.pop(address, None)
+                await self._write_if_changed(address, value)
+
+    async def apply(self, control: str | None, command: tuple[str, int] | None) -> None:
+        """Carry out the control change and power command recorded during a cycle."""
+        if control == "acquire":
+            self.released = False
+            self.last_written_values.pop(REG_RS484_CONTROL_MODE, None)
+            await self._write_if_changed(REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL)
+        elif control == "release":
+            self.released = True
+            await self._write_if_changed(REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL_RELEASE)
+
+        if command is None:
+            return
+        action, watts = command
+        if action == "charge":
+            values = (1, 0, int(watts))
+        elif action == "discharge":
+            values = (2, int(watts), 0)
+        else:
+            values = (0, 0, 0)
+        forced, discharge, charge = values
+        await self._write_if_changed(REG_SET_FORCED_DISCHARGE, forced)
+        await self._write_if_changed(REG_DISCHARGE_SETPOINT, discharge)
+        await self._write_if_changed(REG_CHARGE_SETPOINT, charge)
+
+    async def close(self) -> None:
+        await self._write_if_changed(REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL_RELEASE)
+        self.client.close()
@@ -7,6 +7,8 @@ class FakeBattery(BatteryInterface):
         self.soc = initial_soc
         self.capacity_wh = capacity_wh
         self.current_power = 0  # +W = discharge, -W = charge
+        self.total_charged_wh = 0.0
+        self.total_discharged_wh = 0.0
         self._last_update_time = time.time()
 
     def _update_soc(self):
@@ -22,8 +24,10 @@ class FakeBattery(BatteryInterface):
 
         if self.current_power > 0:
             self.soc = max(0, self.soc - soc_delta)
+            self.total_discharged_wh += wh
         else:
             self.soc = min(100, self.soc + soc_delta)
+            self.total_charged_wh += wh
 
     def get_soc(self) -> float:
         self._update_soc()
@@ -43,3 +47,17 @@ class FakeBattery(BatteryInterface):
     def idle(self) -> None:
         self._update_soc()
         self.current_power = 0
+
+    def aquire_control(self) -> None:
+        pass
+
+    def release(self) -> None:
+        pass
+
+    def get_total_charged_kwh(self) -> float:
+        self._update_soc()
+        return self.total_charged_wh / 1000
+
+    def get_total_discharged_kwh(self) -> float:
+        self._update_soc()
+        return self.total_discharged_wh / 1000
@@ -11,9 +11,12 @@ REG_SET_FORCED_DISCHARGE = 42010  # 0 stop, 1 charge, 2 discharge
 REG_RS484_CONTROL_MODE = 42000
 BATTERY_MODBUS_CONTROL = 0x55aa  # Modbus control mode for Venus battery
 BATTERY_MODBUS_CONTROL_RELEASE = 0x55bb  # Modbus control release value
+# control registers 42000-42021, read back in a single request by the reconciler
+CONTROL_BLOCK_START = REG_RS484_CONTROL_MODE
+CONTROL_BLOCK_COUNT = REG_DISCHARGE_SETPOINT - REG_RS484_CONTROL_MODE + 1
 
 class VenusBattery(BatteryInterface):
-    def __init__(self, ip: str, unit_id: int = 1, name: str = "Venus", port: int = 502):
+    def __init__(self, ip: str, unit_id: int = 1, name: str = "Venus", port: int = 502, reconcile_interval: int = 60):
         self.ip = ip
         self.unit_id = unit_id
         self.port = port
@@ -25,6 +28,8 @@ class VenusBattery(BatteryInterface):
         self.retry_backoff = 1
         self.last_written_values = {}  # register_address -> value
         self.self_control = False  # Flag to indicate if the battery is in self-control mode
+        self.reconcile_interval = reconcile_interval  # seconds between control block read-backs
+        self.drift_events = 0  # registers found different from what we last wrote
         self.logger = get_logger('VenusBattery')
         self._connect()
         self._write_if_changed(REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL)
@@ -74,8 +79,8 @@ class VenusBattery(BatteryInterface):
             self.last_written_values[address] = value
 
     def get_soc(self) -> float:
-        if not self.released and (datetime.now() - self.last_control_mode_check).total_seconds() > 60:
-            self._check_control_mode()
+        if not self.released and (datetime.now() - self.last_control_mode_check).total_seconds() > self.reconcile_interval:
+            self._reconcile_control_block()
             self.last_control_mode_check = datetime.now()
         registers = self._safe_read(REG_SOC, count=1)
         if registers is None or len(registers) < 1:
@@ -147,10 +152,36 @@ class VenusBattery(BatteryInterface):
             mode = registers[0]
             if mode != BATTERY_MODBUS_CONTROL:
                 self.logger.warning(f"[{self.name}] Control mode lost! Reapplying Modbus control...")
+                # the cache may still claim control mode, force the write
+                self.last_written_values.pop(REG_RS484_CONTROL_MODE, None)
                 self._write_if_changed(REG_RS484_CONTROL_MODE, BATTERY_MODBUS_CONTROL)
         except Exception as e:
             self.logger.error(f"[{self.name}] Failed to check/reset control mode: {e}")
 
+    def _reconcile_control_block(self):
+        """
+        Read the whole control block in one request and rewrite every register
+        that no longer holds the value we last wrote (e.g. after a battery
+        reboot or a write by another Modbus client).
+        """
+        registers = self._safe_read(CONTROL_BLOCK_START, count=CONTROL_BLOCK_COUNT)
+        if registers is None:
+            self.logger.warning(f"[{self.name}] Could not read control block. Checking control mode only.")
+            self._check_control_mode()
+            return
+
+        expected = {address: value for address, value in self.last_written_values.items()
+                    if CONTROL_BLOCK_START <= address < CONTROL_BLOCK_START + CONTROL_BLOCK_COUNT}
+        expected[REG_RS484_CONTROL_MODE] = BATTERY_MODBUS_CONTROL
+        for address, value in expected.items():
+            actual = registers[address - CONTROL_BLOCK_START]
+            if actual == value:
+                continue
+            self.drift_events += 1
+            self.logger.warning(f"[{self.name}] Register {address} drifted to {actual} (expected {value}). Rewriting. ({self.drift_events} drift events)")
+            self.last_written_values.pop(address, None)
+            self._write_if_changed(address, value)
+
     def _safe_read(self, address, count=1):
         self._connect()
         if not self.client.connected:
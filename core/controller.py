@@ -1,6 +1,8 @@
 import time
 from interfaces.meter_interface import MeterInterface
 from interfaces.battery_interface import BatteryInterface
+from core.planner import SchedulePlanner, HOLD, CHARGE, DISCHARGE
+from core.efficiency import EfficiencyModel
 from utils.logger import get_logger
 
 
@@ -13,9 +15,11 @@ BATTERY_CHARGE = 3
 BATTERY_SELFCONTROL = 4
 CHARGING = 1
 DISCHARGING = 2
+# battery mode that carries out each planned action
+PLANNED_MODES = {HOLD: BATTERY_HOLD, CHARGE: BATTERY_CHARGE, DISCHARGE: BATTERY_NORMAL}
 
 class Controller:
-    def __init__(self, meter: MeterInterface, batteries: list[BatteryInterface], interval_seconds: int = 5, initial_mode: int = BATTERY_NORMAL, self_control_available: bool = True):
+    def __init__(self, meter: MeterInterface, batteries: list[BatteryInterface], interval_seconds: int = 5, initial_mode: int = BATTERY_NORMAL, self_control_available: bool = True, planner: SchedulePlanner | None = None, efficiency: EfficiencyModel | None = None, meter_max_age: float = 10):
         self.meter = meter
         self.batteries = batteries
         self.interval = interval_seconds
@@ -26,56 +30,177 @@ class Controller:
         self.DISCHARGE_MIN_SOC = 11
         self.CHARGE_LIMIT = 2500
         self.DISCHARGE_LIMIT = 2500
+        self.meter_max_age = meter_max_age  # seconds before a meter reading is too old to act on
+        self.meter_stale = False
         self.self_control_available = self_control_available
+        self.planner = planner
+        self.efficiency = efficiency
         self.mode = initial_mode
+        self.mode_before_plan = None  # mode to return to when the plan runs out
+        self.setpoints = {}  # battery name -> last commanded W (+discharge, -charge)
+        self.energy_counters = {}  # battery name -> (charged kWh, discharged kWh)
+        self.energy_interval = 30  # seconds between energy counter reads
+        self.last_energy_read = 0
+        self.last_snapshot = None
+        self.listeners = []
         self.logger = get_logger('Controller')
         self.set_battery_mode(initial_mode)
 
+    def add_listener(self, callback):
+        """Register a callback that receives the snapshot of every control cycle."""
+        self.listeners.append(callback)
+
     def run_forever(self):
         while True:
-            now = time.time()
-            if self.meter:
-                net_power = self.meter.get_net_power() # Get the net power from the meter
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        now = time.time()
+        meter_ok = True
+        if self.meter and hasattr(self.meter, "get_reading"):
+            # meters that know how old their reading is (CompositeMeter)
+            net_power, age = self.meter.get_reading()
+            meter_ok = age is not None and age <= self.meter_max_age
+        elif self.meter:
+            net_power = self.meter.get_net_power() # Get the net power from the meter
+        else:
+            net_power = 0
+        if meter_ok == self.meter_stale:
+            self.meter_stale = not meter_ok
+            if self.meter_stale:
+                self.logger.warning("Meter reading is missing or too old. Idling the batteries until it recovers.")
             else:
-                net_power = 0
+                self.logger.info("Meter reading recovered.")
 
-            #calculate the total battery power and adjust the net power accordingly
-            battery_power = sum(b.get_current_wattage() for b in self.batteries) # 
-            adjusted_power = net_power + battery_power
-            self.logger.info(f"net: {net_power}W | adjusted: {adjusted_power}W")
-            
-            for b in self.batteries:
-                self.logger.info(f" {b.name}: {b.get_soc()}% @ {b.get_current_wattage()}W")
+        # read every battery once per cycle and reuse the values below
+        readings = [(b, b.get_soc(), b.get_current_wattage()) for b in self.batteries]
+
+        #calculate the total battery power and adjust the net power accordingly
+        battery_power = sum(power for _, _, power in readings)
+        adjusted_power = net_power + battery_power
+        self.logger.info(f"net: {net_power}W | adjusted: {adjusted_power}W")
+
+        for b, soc, power in readings:
+            self.logger.info(f" {b.name}: {soc}% @ {power}W")
+
+        if self.efficiency:
+            if self.mode == BATTERY_SELFCONTROL:
+                self.efficiency.discard_windows()
+            else:
+                self.efficiency.observe_setpoints(now, self.setpoints)
+            self.efficiency.no_split()
+
+        # the planner picks the mode, unless the batteries are in self control
+        if self.planner and self.mode != BATTERY_SELFCONTROL:
+            self._apply_plan(now, [soc for _, soc, _ in readings])
+
+        # do not follow an old meter value; Charge and Selfcontrol do not use the meter
+        if self.meter_stale and self.mode in (BATTERY_NORMAL, BATTERY_HOLD):
+            self._idle_all()
+            self._emit_snapshot(now, net_power, adjusted_power, readings)
+            return
+
+        # if adjusted_power is between -30 and + 30 watt, idle all batteries
+        if adjusted_power >= -30 and adjusted_power <= 30:
+            self._idle_all()
+            self._emit_snapshot(now, net_power, adjusted_power, readings)
+            return
+
+        mode = DISCHARGING if adjusted_power > 0 else CHARGING
 
-            # if adjusted_power is between -30 and + 30 watt, idle all batteries
-            if adjusted_power >= -30 and adjusted_power <= 30:
+        power = abs(adjusted_power)
+        if self.mode == BATTERY_NORMAL:
+            if mode == CHARGING:
+                self._charge(power)
+            else:
+                self._discharge(power)    
+        elif self.mode == BATTERY_HOLD:
+
+            if mode == CHARGING:
+                self._charge(power)
+            else:
                 self._idle_all()
-                time.sleep(self.interval)
-                continue
+        #the easiest case: Just charge all batteries
 
-            mode = DISCHARGING if adjusted_power > 0 else CHARGING
+        elif self.mode == BATTERY_CHARGE:
+            for b in self.batteries:
+                    self._set_charge(b, self.CHARGE_LIMIT)
+        elif self.mode == BATTERY_SELFCONTROL:
+            pass # do nothing, let the batteries control themselves
+        self._emit_snapshot(now, net_power, adjusted_power, readings)
+
+    def _apply_plan(self, now: float, socs: list[float]):
+        try:
+            action = self.planner.action_for(now, socs)
+        except Exception as e:
+            self.logger.error(f"Planner failed: {e}")
+            action = None
+        if action is None:
+            # no plan for this slot: do not stay in a planned Charge or Hold forever
+            if self.mode_before_plan is not None:
+                self.logger.warning(f"No plan for the current slot. Returning to battery mode {self.mode_before_plan}")
+                self.set_battery_mode(self.mode_before_plan)
+                self.mode_before_plan = None
+            return
+        mode = PLANNED_MODES[action]
+        if mode != self.mode:
+            self.logger.info(f"Planner switches battery mode from {self.mode} to {mode}")
+            if self.mode_before_plan is None:
+                self.mode_before_plan = self.mode
+            self.set_battery_mode(mode)
+
+    def _read_energy_counters(self, now: float):
+        if now - self.last_energy_read < self.energy_interval:
+            return
+        self.last_energy_read = now
+        for b in self.batteries:
+            try:
+                self.energy_counters[b.name] = (b.get_total_charged_kwh(), b.get_total_discharged_kwh())
+            except Exception as e:
+                self.logger.warning(f"Failed to read energy counters of {b.name}: {e}")
+                continue
+            if self.efficiency:
+                self.efficiency.observe_counters(b.name, *self.energy_counters[b.name])
 
-            power = abs(adjusted_power)
-            if self.mode == BATTERY_NORMAL:
-                if mode == CHARGING:
-                    self._charge(power)
-                else:
-                    self._discharge(power)    
-            elif self.mode == BATTERY_HOLD:
+    def _emit_snapshot(self, now: float, net_power: int, adjusted_power: int, readings: list):
+        self._read_energy_counters(now)
+        self.last_snapshot = {
+            "ts": now,
+            "mode": self.mode,
+            "net_power": net_power,
+            "adjusted_power": adjusted_power,
+            "efficiency_saved_kwh": self.efficiency.saved_kwh_today if self.efficiency else None,
+            "batteries": {
+                b.name: {
+                    "soc": soc,
+                    "power": power,
+                    "setpoint": self.setpoints.get(b.name, 0),
+                    "charged_kwh": self.energy_counters.get(b.name, (0.0, 0.0))[0],
+                    "discharged_kwh": self.energy_counters.get(b.name, (0.0, 0.0))[1],
+                    # control registers found rewritten by someone else (VenusBattery only)
+                    "drift_events": getattr(b, "drift_events", 0),
+                }
+                for b, soc, power in readings
+            },
+        }
+        for callback in self.listeners:
+            try:
+                callback(self.last_snapshot)
+            except Exception as e:
+                self.logger.error(f"Snapshot listener failed: {e}")
 
-                if mode == CHARGING:
-                    self._charge(power)
-                else:
-                    self._idle_all()
-            #the easiest case: Just charge all batteries
+    def _set_charge(self, b: BatteryInterface, watts: int):
+        b.charge(watts)
+        self.setpoints[b.name] = -watts
 
-            elif self.mode == BATTERY_CHARGE:
-                for b in self.batteries:
-                        b.charge(self.CHARGE_LIMIT)
-            elif self.mode == BATTERY_SELFCONTROL:
-                pass # do nothing, let the batteries control themselves
-            time.sleep(self.interval)
+    def _set_discharge(self, b: BatteryInterface, watts: int):
+        b.discharge(watts)
+        self.setpoints[b.name] = watts
 
+    def _set_idle(self, b: BatteryInterface):
+        b.idle()
+        self.setpoints[b.name] = 0
 
     def _select_target(self, mode: str) -> BatteryInterface | None:
         candidates = []
@@ -96,11 +221,11 @@ class Controller:
     def _idle_others(self, active: list[BatteryInterface]):
         for b in self.batteries:
             if b not in active:
-                b.idle()
+                self._set_idle(b)
 
     def _idle_all(self):
         for b in self.batteries:
-            b.idle()
+            self._set_idle(b)
     def set_battery_mode(self, mode: int = BATTERY_NORMAL):
         if mode == BATTERY_SELFCONTROL:
             if not self.self_control_available:
@@ -109,6 +234,7 @@ class Controller:
             else:
                 for b in self.batteries:
                     b.release()
+                self.setpoints.clear()  # the batteries are no longer following our setpoints
                 self.logger.info("Self-control mode enabled. All batteries will control themselves.")
         else:
             for b in self.batteries:
@@ -142,6 +268,9 @@ class Controller:
     def _charge(self,power: int):
         # get the list of batteries to charge based on priority
         target_batteries = self._get_batteries_priority_list(CHARGING)
+        if self.efficiency and self.efficiency.ready([b.name for b in target_batteries], charging=True):
+            self._dispatch_efficient(power, target_batteries, self.CHARGE_LIMIT, charging=True)
+            return
         #calculate how many batteries can be charged with the given power
         number_of_batteries_to_charge = min(power//self.CHARGE_LIMIT+1, len(target_batteries))
         if number_of_batteries_to_charge == 0:
@@ -157,12 +286,15 @@ class Controller:
 
         for i in range(number_of_batteries_to_charge):
             battery = target_batteries[i]
-            battery.charge(power_per_battery)
+            self._set_charge(battery, power_per_battery)
         self._idle_others(target_batteries[:number_of_batteries_to_charge])
         
     def _discharge(self,power: int):
         # get the list of batteries to charge based on priority
         target_batteries = self._get_batteries_priority_list(DISCHARGING)
+        if self.efficiency and self.efficiency.ready([b.name for b in target_batteries], charging=False):
+            self._dispatch_efficient(power, target_batteries, self.DISCHARGE_LIMIT, charging=False)
+            return
         #calculate how many batteries can be charged with the given power
         number_of_batteries_to_discharge = min(power//self.DISCHARGE_LIMIT+1, len(target_batteries))
         if number_of_batteries_to_discharge == 0:
@@ -178,9 +310,25 @@ class Controller:
 
         for i in range(number_of_batteries_to_discharge):
             battery = target_batteries[i]
-            battery.discharge(power_per_battery)
+            self._set_discharge(battery, power_per_battery)
         self._idle_others(target_batteries[:number_of_batteries_to_discharge])
     
+    def _dispatch_efficient(self, power: int, target_batteries: list[BatteryInterface], limit: int, charging: bool):
+        # let the learned loss curves pick the batteries and their shares
+        shares = self.efficiency.split(int(power), [b.name for b in target_batteries], limit, charging)
+        self.logger.debug(f"Efficiency split for {power}W: {shares}")
+        active = []
+        for battery in target_batteries:
+            watts = shares.get(battery.name, 0)
+            if watts <= 0:
+                continue
+            if charging:
+                self._set_charge(battery, watts)
+            else:
+                self._set_discharge(battery, watts)
+            active.append(battery)
+        self._idle_others(active)
+
     def _battery_is_eligible(self, b: BatteryInterface, mode: int) -> bool:
         soc = b.get_soc()
         if mode == CHARGING:
@@ -0,0 +1,231 @@
+from datetime import datetime
+from itertools import combinations
+from utils.logger import get_logger
+
+
+class LossCurve:
+    """
+    Conversion loss of one battery in one direction, L(P) = c0 + c1*P + c2*P^2
+    (kW in, kW out), fitted online with recursive least squares. Memory is a
+    fixed 3x3 covariance matrix no matter how many samples were seen.
+
+    c0, c1 and c2 can only be told apart from windows at different power
+    levels, so the curve also remembers which power bands it has seen.
+    """
+
+    band_kw = 0.5
+    max_trace = 300.0  # trace of the prior covariance
+
+    def __init__(self, forgetting: float = 0.998):
+        self.forgetting = forgetting
+        # prior: ~20 W standby loss and a few percent conversion loss
+        self.theta = [0.02, 0.03, 0.01]
+        self.cov = [[100.0, 0.0, 0.0], [0.0, 100.0, 0.0], [0.0, 0.0, 100.0]]
+        self.samples = 0
+        self.bands = set()
+
+    def update(self, x: list[float], y: float) -> None:
+        """
+        x: [active hours, kWh commanded, sum(P^2 * dt)] over a window
+        y: energy lost over that window in kWh
+        """
+        px = [sum(self.cov[i][j] * x[j] for j in range(3)) for i in range(3)]
+        denominator = self.forgetting + sum(x[i] * px[i] for i in range(3))
+        gain = [v / denominator for v in px]
+        error = y - sum(self.theta[i] * x[i] for i in range(3))
+        self.theta = [self.theta[i] + gain[i] * error for i in range(3)]
+        # a negative standby or quadratic term is not physical and would make
+        # the variable part concave, which the greedy split relies on not being
+        self.theta[0] = max(0.0, self.theta[0])
+        self.theta[2] = max(0.0, self.theta[2])
+        self.cov = [[(self.cov[i][j] - gain[i] * px[j]) / self.forgetting for j in range(3)] for i in range(3)]
+        # forgetting inflates the covariance in directions the samples do not
+        # excite; cap it at the prior to avoid windup
+        trace = self.cov[0][0] + self.cov[1][1] + self.cov[2][2]
+        if trace > self.max_trace:
+            scale = self.max_trace / trace
+            self.cov = [[v * scale for v in row] for row in self.cov]
+        self.samples += 1
+        if x[0] > 0:
+            self.bands.add(int(x[1] / x[0] / self.band_kw))
+
+    def loss_w(self, watts: float) -> float:
+        if watts <= 0:
+            return 0.0
+        kw = watts / 1000
+        c0, c1, c2 = self.theta
+        return max(0.0, c0 + c1 * kw + c2 * kw * kw) * 1000
+
+    def variable_w(self, watts: float) -> float:
+        """The load dependent part of the loss, without the standby term."""
+        kw = watts / 1000
+        _, c1, c2 = self.theta
+        return (c1 * kw + c2 * kw * kw) * 1000
+
+
+class _Window:
+    __slots__ = ("hours", "kwh", "kw2h", "counter_start")
+
+    def __init__(self, counter_start: float):
+        self.hours = 0.0
+        self.kwh = 0.0
+        self.kw2h = 0.0
+        self.counter_start = counter_start
+
+
+class EfficiencyModel:
+    """
+    Learns a loss curve per battery and direction from the energy counters
+    (33000 charged, 33002 discharged) and the setpoints the controller
+    commanded, and uses the curves to pick which batteries to run and how to
+    split the power between them.
+
+    Between counter readings the commanded power is integrated per battery and
+    direction. Once a counter has moved by min_counter_kwh the window becomes
+    one regression sample: for charging the loss is what was commanded minus
+    what the charge counter added, for discharging what the discharge counter
+    added minus what was commanded.
+    """
+
+    def __init__(self, min_counter_kwh: float = 0.5, min_samples: int = 3, min_bands: int = 3,
+                 step_w: int = 50, hysteresis_w: float = 5):
+        self.min_counter_kwh = min_counter_kwh
+        self.min_samples = min_samples
+        self.min_bands = min_bands
+        self.step_w = step_w
+        self.hysteresis_w = hysteresis_w
+        self.curves = {}  # (battery name, charging) -> LossCurve
+        self.windows = {}  # (battery name, charging) -> _Window
+        self.active = {True: None, False: None}  # last chosen set of names per direction
+        self.last_observation = None
+        self.pending_saving_w = 0.0
+        self.saved_kwh_today = 0.0
+        self.day = datetime.now().date()
+        self.logger = get_logger('Efficiency')
+
+    def _curve(self, name: str, charging: bool) -> LossCurve:
+        key = (name, charging)
+        if key not in self.curves:
+            self.curves[key] = LossCurve()
+        return self.curves[key]
+
+    def observe_setpoints(self, now: float, setpoints: dict) -> None:
+        """Integrate the setpoints that were in effect since the previous call."""
+        hours = 0.0
+        if self.last_observation is not None:
+            # ignore gaps (e.g. a stalled cycle) rather than book them
+            hours = min(now - self.last_observation, 60) / 3600
+        self.last_observation = now
+
+        for name, watts in setpoints.items():
+            window = self.windows.get((name, watts < 0))
+            if watts == 0 or window is None:
+                continue
+            kw = abs(watts) / 1000
+            window.hours += hours
+            window.kwh += kw * hours
+            window.kw2h += kw * kw * hours
+
+        self.saved_kwh_today += self.pending_saving_w / 1000 * hours
+        today = datetime.now().date()
+        if today != self.day:
+            self.logger.info(f"Efficiency dispatch saved {self.saved_kwh_today:.3f} kWh on {self.day}")
+            self.logger.info(f"Loss curves: {self.describe()}")
+            self.day = today
+            self.saved_kwh_today = 0.0
+
+    def observe_counters(self, name: str, charged_kwh: float, discharged_kwh: float) -> None:
+        for charging, counter in ((True, charged_kwh), (False, discharged_kwh)):
+            key = (name, charging)
+            window = self.windows.get(key)
+            if window is None or counter < window.counter_start:
+                self.windows[key] = _Window(counter)
+                continue
+            delta = counter - window.counter_start
+            if delta < self.min_counter_kwh:
+                continue
+            loss = window.kwh - delta if charging else delta - window.kwh
+            # windows where the battery did not follow its setpoint are not usable
+            if window.kwh > 0 and 0 <= loss <= 0.5 * window.kwh:
+                self._curve(name, charging).update([window.hours, window.kwh, window.kw2h], loss)
+            self.windows[key] = _Window(counter)
+
+    def discard_windows(self) -> None:
+        """Forget partial windows, e.g. while the batteries control themselves."""
+        self.windows.clear()
+        self.last_observation = None
+
+    def ready(self, names: list[str], charging: bool) -> bool:
+        """True once every curve has enough samples at enough different power levels."""
+        if not names:
+            return False
+        for name in names:
+            curve = self._curve(name, charging)
+            if curve.samples < self.min_samples or len(curve.bands) < self.min_bands:
+                return False
+        return True
+
+    def _allocate(self, names: tuple, total: int, limit: int, charging: bool) -> tuple[dict, float]:
+        # hand out the power in small steps, each to the battery where it adds
+        # the least load dependent loss; standby losses are the same for every
+        # split within a subset
+        curves = [self._curve(name, charging) for name in names]
+        shares = [0] * len(names)
+        remaining = min(total, limit * len(names))
+        while remaining > 0:
+            step = min(self.step_w, remaining)
+            best, best_increase = None, None
+            for i, curve in enumerate(curves):
+                if shares[i] + step > limit:
+                    continue
+                increase = curve.variable_w(shares[i] + step) - curve.variable_w(shares[i])
+                if best is None or increase < best_increase:
+                    best, best_increase = i, increase
+            if best is None:
+                break
+            shares[best] += step
+            remaining -= step
+        loss = sum(curve.loss_w(share) for curve, share in zip(curves, shares))
+        return dict(zip(names, shares)), loss
+
+    def _baseline(self, names: list[str], total: int, limit: int, charging: bool) -> float:
+        # what the SoC-only dispatch would do: equal shares over the first batteries
+        count = min(total // limit + 1, len(names))
+        share = min(total // count, limit)
+        return sum(self._curve(name, charging).loss_w(share) for name in names[:count])
+
+    def split(self, total: int, names: list[str], limit: int, charging: bool) -> dict:
+        """
+        Return {battery name: watts} for the least total loss. names are the
+        eligible batteries in SoC priority order.
+        """
+        needed = max(1, -(-total // limit))
+        candidates = {}
+        for count in range(min(needed, len(names)), len(names) + 1):
+            for subset in combinations(names, count):
+                candidates[subset] = self._allocate(subset, total, limit, charging)
+
+        chosen = min(candidates, key=lambda subset: candidates[subset][1])
+        # compare as sets: the same batteries come in a different order when
+        # their SoC priority changes
+        current = next((subset for subset in candidates if frozenset(subset) == self.active[charging]), None)
+        if current is not None and candidates[current][1] - candidates[chosen][1] < self.hysteresis_w:
+            chosen = current  # not worth switching batteries for
+        self.active[charging] = frozenset(chosen)
+
+        shares, loss = candidates[chosen]
+        self.pending_saving_w = self._baseline(names, total, limit, charging) - loss
+        return shares
+
+    def no_split(self) -> None:
+        """The last dispatch did not use split(); nothing is being saved."""
+        self.pending_saving_w = 0.0
+
+    def describe(self) -> str:
+        parts = []
+        for (name, charging), curve in sorted(self.curves.items()):
+            c0, c1, c2 = curve.theta
+            parts.append(f"{name} {'charge' if charging else 'discharge'}: "
+                         f"{c0 * 1000:.0f}W + {c1 * 100:.1f}% + {c2 * 1000:.1f}W/kW^2 "
+                         f"({curve.samples} samples, {len(curve.bands)} power bands)")
+        return "; ".join(parts)
@@ -0,0 +1,338 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import resource
+import time
+from core.controller import Controller, BATTERY_NORMAL
+from interfaces.battery_interface import BatteryInterface
+from interfaces.meter_interface import MeterInterface
+from utils.logger import get_logger
+
+
+class SiteMeter(MeterInterface):
+    """Meter reading fetched by the site before the control cycle."""
+    __slots__ = ("power", "last_update")
+
+    def __init__(self):
+        self.power = 0
+        self.last_update = None  # when the async meter last read successfully
+
+    def get_net_power(self) -> int:
+        return self.power
+
+    def get_reading(self) -> tuple[int, float | None]:
+        """Return (net power in W, age of the reading in seconds), like CompositeMeter."""
+        age = None if self.last_update is None else time.time() - self.last_update
+        return self.power, age
+
+
+class SiteBattery(BatteryInterface):
+    """
+    What the Controller of a site sees as a battery: the state read by the
+    site's async driver before the cycle, and a record of the commands the
+    controller gives, which the site applies after the cycle.
+    """
+    __slots__ = ("name", "soc", "power", "charged_kwh", "discharged_kwh", "drift_events", "control", "command")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.soc = 0
+        self.power = 0
+        self.charged_kwh = 0.0
+        self.discharged_kwh = 0.0
+        self.drift_events = 0  # copied from the async driver
+        self.control = None  # "acquire" / "release" pending
+        self.command = None  # (action, watts) pending
+
+    def get_soc(self) -> float:
+        return self.soc
+
+    def get_current_wattage(self) -> int:
+        return self.power
+
+    def charge(self, watts: int) -> None:
+        self.command = ("charge", watts)
+
+    def discharge(self, watts: int) -> None:
+        self.command = ("discharge", watts)
+
+    def idle(self) -> None:
+        self.command = ("idle", 0)
+
+    def aquire_control(self) -> None:
+        self.control = "acquire"
+
+    def release(self) -> None:
+        self.control = "release"
+
+    def get_total_charged_kwh(self) -> float:
+        return self.charged_kwh
+
+    def get_total_discharged_kwh(self) -> float:
+        return self.discharged_kwh
+
+    def take_pending(self) -> tuple:
+        pending = (self.control, self.command)
+        self.control = None
+        self.command = None
+        return pending
+
+
+class Site:
+    """One household: a meter, its batteries and their own Controller."""
+
+    def __init__(self, name: str, meter, drivers: list, interval: float,
+                 initial_mode: int = BATTERY_NORMAL, self_control_available: bool = True,
+                 energy_interval: float = 30, meter_max_age: float = 10):
+        self.name = name
+        self.meter = meter
+        self.drivers = drivers
+        self.site_meter = SiteMeter()
+        self.proxies = [SiteBattery(driver.name) for driver in drivers]
+        self.controller = Controller(meter=self.site_meter if meter else None, batteries=self.proxies,
+                                     interval_seconds=interval, initial_mode=initial_mode,
+                                     self_control_available=self_control_available,
+                                     meter_max_age=meter_max_age)
+        self.energy_interval = energy_interval
+        self.last_energy_read = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.task = None
+        self.published_mode = None
+
+    async def cycle(self) -> None:
+        """Read everything concurrently, run one control cycle, write the commands back."""
+        now = time.time()
+        read_energy = now - self.last_energy_read >= self.energy_interval
+        reads = [driver.read_state() for driver in self.drivers]
+        if self.meter:
+            reads.append(self.meter.get_net_power())
+        # the energy counters are not needed for control: a failed read keeps
+        # the previous counters instead of failing the cycle
+        energy_reads = [driver.read_energy() for driver in self.drivers] if read_energy else []
+        results, energy = await asyncio.gather(asyncio.gather(*reads),
+                                               asyncio.gather(*energy_reads, return_exceptions=True))
+
+        for driver, proxy, (soc, power) in zip(self.drivers, self.proxies, results):
+            proxy.soc = soc
+            proxy.power = power
+            proxy.drift_events = driver.drift_events
+        if read_energy:
+            self.last_energy_read = now
+            for proxy, counters in zip(self.proxies, energy):
+                if isinstance(counters, Exception):
+                    continue
+                proxy.charged_kwh, proxy.discharged_kwh = counters
+        if self.meter:
+            # the async meter falls back to its last value on errors; the age
+            # lets the controller idle the site when that value gets old
+            self.site_meter.power = results[-1]
+            self.site_meter.last_update = self.meter.last_update
+
+        self.controller.run_once()
+        await asyncio.gather(*(driver.apply(*proxy.take_pending())
+                               for driver, proxy in zip(self.drivers, self.proxies)))
+
+    async def idle(self) -> None:
+        """Best effort: stop forced charging/discharging while the site is not controlled."""
+        await asyncio.gather(*(driver.apply(None, ("idle", 0)) for driver in self.drivers),
+                             return_exceptions=True)
+
+
+class FleetRuntime:
+    """
+    Runs many independent sites in one asyncio event loop.
+
+    A single scheduler spreads the site cycles evenly over the interval. A site
+    whose cycle fails or times out backs off on its own; the other sites keep
+    running. All sites share one MQTT connection with a topic prefix per site.
+    """
+
+    def __init__(self, sites: list[Site], interval: float = 3, max_concurrent: int = 100,
+                 mqtt_client=None, topic_prefix: str = "mmbc"):
+        self.sites = sites
+        self.interval = interval
+        self.semaphore = None
+        self.max_concurrent = max_concurrent
+        self.mqtt = mqtt_client
+        self.topic_prefix = topic_prefix
+        self.sites_by_name = {site.name: site for site in sites}
+        self.loop = None
+        self.cycles = 0
+        self.cycle_time = 0.0
+        self.overruns = 0
+        self.logger = get_logger('Fleet')
+
+    @classmethod
+    def from_file(cls, path: str, mqtt_client=None, topic_prefix: str = "mmbc") -> "FleetRuntime":
+        """
+        Build a fleet from a JSON file:
+
+            {"interval": 3,
+             "meter_max_age": 10,
+             "sites": [{"name": "home1",
+                        "meter": {"host": "http://192.168.1.50"},
+                        "batteries": [{"ip": "192.168.1.101", "unit_id": 1, "port": 502}],
+                        "mode": "normal",
+                        "self_control_available": true}]}
+        """
+        from batteries.async_venus_battery import AsyncVenusBattery
+        from meters.async_homewizard_p1_meter import AsyncHomeWizardP1Meter
+        from core.mqtt_publisher import parse_battery_mode
+
+        with open(path) as f:
+            config = json.load(f)
+        interval = config.get("interval", 3)
+        meter_max_age = config.get("meter_max_age", 10)
+        sites = []
+        for entry in config["sites"]:
+            meter = AsyncHomeWizardP1Meter(entry["meter"]["host"]) if entry.get("meter") else None
+            drivers = [AsyncVenusBattery(ip=b["ip"], unit_id=b.get("unit_id", 1), port=b.get("port", 502),
+                                         name=b.get("name", f"VenusBattery{i}"))
+                       for i, b in enumerate(entry["batteries"], start=1)]
+            sites.append(Site(entry["name"], meter, drivers, interval,
+                              initial_mode=parse_battery_mode(str(entry.get("mode", "normal"))) or BATTERY_NORMAL,
+                              self_control_available=entry.get("self_control_available", True),
+                              meter_max_age=meter_max_age))
+        return cls(sites, interval=interval, mqtt_client=mqtt_client, topic_prefix=topic_prefix)
+
+    async def run(self, duration: float | None = None) -> None:
+        if not self.sites:
+            self.logger.warning("No sites configured")
+            return
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.mqtt:
+            self._subscribe()
+        start = self.loop.time()
+        # stagger the sites over the interval so their I/O does not arrive in bursts
+        spacing = self.interval / max(1, len(self.sites))
+        queue = [(start + i * spacing, i) for i in range(len(self.sites))]
+        heapq.heapify(queue)
+        next_stats = start + 60
+        try:
+            while duration is None or self.loop.time() - start < duration:
+                due, index = queue[0]
+                now = self.loop.time()
+                if due > now:
+                    await asyncio.sleep(due - now)
+                    continue
+                heapq.heapreplace(queue, (max(due + self.interval, now), index))
+                site = self.sites[index]
+                if time.time() < site.retry_at:
+                    continue
+                if site.task and not site.task.done():
+                    self.overruns += 1
+                    continue
+                site.task = asyncio.create_task(self._run_site(site))
+                if now >= next_stats:
+                    next_stats = now + 60
+                    self.log_stats()
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self) -> None:
+        """Wait for running cycles, then hand every battery back to its own control."""
+        running = [site.task for site in self.sites if site.task and not site.task.done()]
+        await asyncio.gather(*running, return_exceptions=True)
+        await asyncio.gather(*(driver.close() for site in self.sites for driver in site.drivers),
+                             return_exceptions=True)
+
+    async def _run_site(self, site: Site) -> None:
+        started = time.perf_counter()
+        try:
+            async with self.semaphore:
+                await asyncio.wait_for(site.cycle(), timeout=self.interval * 2)
+        except Exception as e:
+            site.failures += 1
+            backoff = min(self.interval * 2 ** site.failures, 300)
+            site.retry_at = time.time() + backoff
+            self.logger.warning(f"[{site.name}] Cycle failed ({site.failures}x): {e!r}. Retrying in {backoff:.0f}s")
+            # nothing controls the batteries during the backoff, so do not
+            # leave them on their last forced setpoint
+            try:
+                await asyncio.wait_for(site.idle(), timeout=self.interval)
+            except Exception as e:
+                self.logger.warning(f"[{site.name}] Failed to idle batteries: {e!r}")
+            return
+        if site.failures:
+            self.logger.info(f"[{site.name}] Recovered after {site.failures} failed cycles")
+        site.failures = 0
+        self.cycles += 1
+        self.cycle_time += time.perf_counter() - started
+        if self.mqtt:
+            self._publish(site)
+
+    def log_stats(self) -> None:
+        failing = sum(1 for site in self.sites if site.failures)
+        # whole process, interpreter included; tools/bench_fleet.py measures per site
+        rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        average = self.cycle_time / self.cycles * 1000 if self.cycles else 0
+        self.logger.info(f"{len(self.sites)} sites, {failing} failing, {self.cycles} cycles "
+                         f"(avg {average:.1f}ms), {self.overruns} overruns, "
+                         f"process peak RSS {rss_kib // 1024} MiB")
+
+    def _subscribe(self) -> None:
+        from core.mqtt_publisher import parse_battery_mode
+
+        def on_message(client, userdata, msg):
+            # runs on the paho thread: hand the mode change to the event loop
+            parts = msg.topic.split("/")
+            site = self.sites_by_name.get(parts[-3]) if len(parts) >= 3 else None
+            mode = parse_battery_mode(msg.payload.decode())
+            if site is None or mode is None:
+                self.logger.warning(f"[MQTT] Ignoring {msg.topic}: {msg.payload!r}")
+                return
+            self.loop.call_soon_threadsafe(site.controller.set_battery_mode, mode)
+
+        self.mqtt.on_message = on_message
+        self.mqtt.subscribe(f"{self.topic_prefix}/+/control/batterymode")
+
+    def _publish(self, site: Site) -> None:
+        from core.mqtt_publisher import MqttPublisher
+
+        snapshot = site.controller.last_snapshot
+        prefix = f"{self.topic_prefix}/{site.name}"
+        if site.controller.mode != site.published_mode:
+            label = MqttPublisher.MODE_LABELS.get(site.controller.mode, "Selfcontrol")
+            self.mqtt.publish(f"{prefix}/status/batterymode", label, retain=True)
+            site.published_mode = site.controller.mode
+        total_power = 0
+        total_soc = 0
+        for index, state in enumerate(snapshot["batteries"].values(), start=1):
+            total_power += state["power"]
+            total_soc += state["soc"]
+            self.mqtt.publish(f"{prefix}/battery{index}/soc", state["soc"])
+            self.mqtt.publish(f"{prefix}/battery{index}/power", state["power"])
+            self.mqtt.publish(f"{prefix}/battery{index}/drift_events", state["drift_events"])
+        count = len(snapshot["batteries"])
+        self.mqtt.publish(f"{prefix}/soc", round(total_soc / count, 2) if count else 0)
+        self.mqtt.publish(f"{prefix}/power", total_power)
+
+
+def quiet_site_logging(level: str = "WARNING") -> None:
+    """Per-cycle controller logging does not scale to hundreds of sites."""
+    get_logger('Controller').setLevel(getattr(logging, level.upper(), logging.WARNING))
+
+
+def run_fleet(path: str) -> None:
+    import paho.mqtt.client as mqtt
+    from core.mqtt_publisher import MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD
+    from core.config_loader import get_config_value
+
+    quiet_site_logging(get_config_value("FLEET_LOG_LEVEL", "WARNING"))
+    client = mqtt.Client(client_id=f"mmbc-fleet-{os.getpid()}")
+    if MQTT_USERNAME and MQTT_PASSWORD:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    try:
+        client.connect(MQTT_HOST, MQTT_PORT, 60)
+        client.loop_start()
+    except Exception as e:
+        get_logger('Fleet').error(f"[MQTT] Failed to connect: {e}")
+        client = None
+    fleet = FleetRuntime.from_file(path, mqtt_client=client,
+                                   topic_prefix=get_config_value("FLEET_TOPIC_PREFIX", "mmbc/site"))
+    get_logger('Fleet').info(f"Running {len(fleet.sites)} sites every {fleet.interval}s")
+    asyncio.run(fleet.run())
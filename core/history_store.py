@@ -0,0 +1,328 @@
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from utils.logger import get_logger
+
+# (name, bucket seconds, retention seconds). The raw tier keeps every control
+# cycle, the others keep the mean of each bucket.
+TIERS = (
+    ("raw", None, 3600),
+    ("1m", 60, 7 * 86400),
+    ("15m", 900, 365 * 86400),
+)
+
+SNAPSHOT_VERSION = 1
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Ring:
+    """Fixed size columnar ring buffer. Memory is allocated once, up front."""
+
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.width = width
+        self.ts = array("d", bytes(8 * capacity))
+        self.data = array("f", bytes(4 * capacity * width))
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def append(self, ts: float, row) -> None:
+        self.ts[self.head] = ts
+        offset = self.head * self.width
+        self.data[offset:offset + self.width] = array("f", row)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _slot(self, i: int) -> int:
+        # logical index (0 = oldest) -> physical slot
+        return (self.head - self.count + i) % self.capacity
+
+    def bisect(self, t: float) -> int:
+        """Return the first logical index with a timestamp >= t."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, start: float, end: float, columns: list[int]) -> list[list]:
+        result = []
+        for i in range(self.bisect(start), self.count):
+            slot = self._slot(i)
+            ts = self.ts[slot]
+            if ts > end:
+                break
+            offset = slot * self.width
+            row = [ts]
+            for c in columns:
+                value = self.data[offset + c]
+                row.append(None if math.isnan(value) else round(value, 2))
+            result.append(row)
+        return result
+
+    def oldest(self) -> float | None:
+        return self.ts[self._slot(0)] if self.count else None
+
+
+class _Tier:
+    def __init__(self, name: str, bucket: int | None, retention: int, interval: float, width: int):
+        self.name = name
+        self.bucket = bucket
+        self.retention = retention
+        step = bucket or interval
+        self.ring = _Ring(int(math.ceil(retention / step)) + 1, width)
+        self.bucket_start = None
+        self.sums = [0.0] * width
+        self.counts = [0] * width
+
+    def add(self, ts: float, row: list[float]) -> None:
+        if self.bucket is None:
+            self.ring.append(ts, row)
+            return
+
+        bucket_start = ts - ts % self.bucket
+        if self.bucket_start is not None and bucket_start != self.bucket_start:
+            self._flush()
+        self.bucket_start = bucket_start
+        for i, value in enumerate(row):
+            if not math.isnan(value):
+                self.sums[i] += value
+                self.counts[i] += 1
+
+    def _flush(self) -> None:
+        mean = [s / n if n else math.nan for s, n in zip(self.sums, self.counts)]
+        self.ring.append(self.bucket_start, mean)
+        self.sums = [0.0] * len(self.sums)
+        self.counts = [0] * len(self.counts)
+
+
+class HistoryStore:
+    """
+    Bounded in-memory history of the per-cycle controller snapshots.
+
+    Every cycle is kept for an hour, 1-minute means for a week and 15-minute
+    means for a year. All buffers are allocated when the store is created so
+    memory use does not grow with uptime.
+    """
+
+    def __init__(self, battery_names: list[str], interval_seconds: float):
+        self.columns = ["net_power", "adjusted_power"]
+        for name in battery_names:
+            self.columns += [f"{name}.soc", f"{name}.power", f"{name}.setpoint"]
+        self.battery_names = list(battery_names)
+        self.tiers = [_Tier(name, bucket, retention, interval_seconds, len(self.columns))
+                      for name, bucket, retention in TIERS]
+        self.lock = threading.Lock()
+        self.persistence_path = None
+        self.logger = get_logger('HistoryStore')
+
+    def memory_bytes(self) -> int:
+        return sum(t.ring.ts.itemsize * len(t.ring.ts) + t.ring.data.itemsize * len(t.ring.data)
+                   for t in self.tiers)
+
+    def record(self, snapshot: dict) -> None:
+        """Controller listener: append one cycle snapshot to every tier."""
+        row = [float(snapshot["net_power"]), float(snapshot["adjusted_power"])]
+        for name in self.battery_names:
+            battery = snapshot["batteries"].get(name)
+            if battery is None:
+                row += [math.nan, math.nan, math.nan]
+            else:
+                row += [float(battery["soc"]), float(battery["power"]), float(battery["setpoint"])]
+        with self.lock:
+            for tier in self.tiers:
+                tier.add(snapshot["ts"], row)
+
+    def query(self, start: float, end: float | None = None, tier: str | None = None,
+              columns: list[str] | None = None) -> dict:
+        """
+        Return the rows between start and end (epoch seconds). Unless a tier is
+        given, the finest tier that still holds start is used.
+        """
+        end = time.time() if end is None else end
+        if tier is None:
+            with self.lock:
+                # a tier that is not full yet holds everything recorded so far
+                covering = [t for t in self.tiers
+                            if t.ring.count < t.ring.capacity or t.ring.oldest() <= start]
+            selected = covering[0] if covering else self.tiers[-1]
+        else:
+            selected = next((t for t in self.tiers if t.name == tier), None)
+            if selected is None:
+                raise ValueError(f"Unknown tier: {tier}")
+
+        columns = columns or self.columns
+        indexes = []
+        for column in columns:
+            if column not in self.columns:
+                raise ValueError(f"Unknown column: {column}")
+            indexes.append(self.columns.index(column))
+
+        with self.lock:
+            rows = selected.ring.rows(start, end, indexes)
+        return {"tier": selected.name, "columns": ["ts"] + columns, "rows": rows}
+
+    def save(self, path: str) -> None:
+        with self.lock:
+            header = {
+                "version": SNAPSHOT_VERSION,
+                "columns": self.columns,
+                "tiers": [{
+                    "name": t.name,
+                    "capacity": t.ring.capacity,
+                    "head": t.ring.head,
+                    "count": t.ring.count,
+                    "bucket_start": t.bucket_start,
+                    "sums": t.sums,
+                    "counts": t.counts,
+                } for t in self.tiers],
+            }
+            blobs = [(t.ring.ts.tobytes(), t.ring.data.tobytes()) for t in self.tiers]
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for ts_blob, data_blob in blobs:
+                f.write(ts_blob)
+                f.write(data_blob)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """Restore a snapshot written by save(). Returns False if it does not fit this store."""
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != SNAPSHOT_VERSION or header.get("columns") != self.columns:
+                    self.logger.warning(f"History snapshot {path} does not match current configuration. Ignoring it.")
+                    return False
+                if [t["capacity"] for t in header["tiers"]] != [t.ring.capacity for t in self.tiers]:
+                    self.logger.warning(f"History snapshot {path} has different tier sizes. Ignoring it.")
+                    return False
+                # read and check everything first, so a truncated or corrupt
+                # file leaves the store untouched
+                restored = []
+                for tier, meta in zip(self.tiers, header["tiers"]):
+                    ring = tier.ring
+                    ts = array("d")
+                    ts.frombytes(f.read(8 * ring.capacity))
+                    data = array("f")
+                    data.frombytes(f.read(4 * ring.capacity * ring.width))
+                    if len(ts) != ring.capacity or len(data) != ring.capacity * ring.width:
+                        raise ValueError(f"tier {tier.name} is truncated")
+                    if not (0 <= meta["head"] < ring.capacity and 0 <= meta["count"] <= ring.capacity):
+                        raise ValueError(f"tier {tier.name} has an invalid position")
+                    if len(meta["sums"]) != ring.width or len(meta["counts"]) != ring.width:
+                        raise ValueError(f"tier {tier.name} has invalid bucket sums")
+                    if not (meta["bucket_start"] is None or _is_number(meta["bucket_start"])) \
+                            or not all(_is_number(v) for v in meta["sums"]) \
+                            or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in meta["counts"]):
+                        raise ValueError(f"tier {tier.name} has invalid bucket values")
+                    restored.append((ts, data, meta))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            self.logger.error(f"Failed to load history snapshot {path}: {e}")
+            return False
+
+        with self.lock:
+            for tier, (ts, data, meta) in zip(self.tiers, restored):
+                tier.ring.ts = ts
+                tier.ring.data = data
+                tier.ring.head = meta["head"]
+                tier.ring.count = meta["count"]
+                tier.bucket_start = meta["bucket_start"]
+                tier.sums = meta["sums"]
+                tier.counts = meta["counts"]
+        self.logger.info(f"Restored history from {path}")
+        return True
+
+    def start_persistence(self, path: str, interval: int = 300) -> None:
+        """Restore from path and save a snapshot to it every interval seconds."""
+        self.persistence_path = path
+        self.load(path)
+
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save(path)
+                except Exception as e:
+                    self.logger.error(f"Failed to save history snapshot {path}: {e}")
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def save_now(self) -> None:
+        """Write the snapshot on shutdown, so a restart loses nothing since the last save."""
+        if not self.persistence_path:
+            return
+        try:
+            self.save(self.persistence_path)
+            self.logger.info(f"Saved history to {self.persistence_path}")
+        except Exception as e:
+            self.logger.error(f"Failed to save history snapshot {self.persistence_path}: {e}")
+
+
+class HistoryServer:
+    """
+    Small local HTTP endpoint on top of a HistoryStore:
+
+        GET /history?start=<epoch>&end=<epoch>&tier=<raw|1m|15m>&columns=a,b
+        GET /history/columns
+    """
+
+    def __init__(self, store: HistoryStore, host: str = "0.0.0.0", port: int = 8081):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.logger = get_logger('HistoryServer')
+
+    def start(self) -> None:
+        store = self.store
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                try:
+                    if url.path == "/history/columns":
+                        body = {"columns": store.columns}
+                    elif url.path == "/history":
+                        now = time.time()
+                        columns = params["columns"][0].split(",") if "columns" in params else None
+                        body = store.query(
+                            start=float(params.get("start", [now - 3600])[0]),
+                            end=float(params["end"][0]) if "end" in params else None,
+                            tier=params.get("tier", [None])[0],
+                            columns=columns,
+                        )
+                    else:
+                        self.send_error(404)
+                        return
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # keep the request log out of the controller output
+
+        server = ThreadingHTTPServer((self.host, self.port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.logger.info(f"History endpoint listening on {self.host}:{self.port}")
@@ -21,6 +21,15 @@ HA_DISCOVERY_PREFIX = "homeassistant"
 DEVICE_ID = "MMBC_Combined_Battery"
 DEVICE_NAME = "MMBC Combined Battery"
 
+def parse_battery_mode(payload: str) -> int | None:
+    """Map a batterymode command (label or number) to a controller mode."""
+    return {
+        "normal": 1, "1": 1,
+        "hold": 2, "2": 2,
+        "charge": 3, "3": 3,
+        "selfcontrol": 4, "4": 4,
+    }.get(payload.strip().lower())
+
 class MqttPublisher:
     def __init__(self,controller, batteries, interval=10):
         self.controller = controller
@@ -30,6 +39,7 @@ class MqttPublisher:
 
         self.thread = threading.Thread(target=self._run, daemon=True)
         self.running = False
+        self.published_mode = None
         self.logger = get_logger('MqttPublisher')
 
     MODE_LABELS = {1: "Normal", 2: "Hold", 3: "Charge", 4: "Selfcontrol"}
@@ -37,25 +47,27 @@ class MqttPublisher:
     def _publish_initial_mode(self):
         label = self.MODE_LABELS.get(self.controller.mode, "Selfcontrol")
         self.client.publish("mmbc/status/batterymode", label, retain=True)
+        self.published_mode = self.controller.mode
         self.logger.info(f"[MQTT] Initial battery mode published: {label}")
 
+    def _publish_mode_if_changed(self):
+        # the mode can also change without an MQTT command, e.g. by the planner
+        if self.controller.mode != self.published_mode:
+            label = self.MODE_LABELS.get(self.controller.mode, "Selfcontrol")
+            self.client.publish("mmbc/status/batterymode", label, retain=True)
+            self.published_mode = self.controller.mode
+
     def on_mqtt_message(self,client, userdata, msg):
         if msg.topic == "mmbc/control/batterymode":
             payload = msg.payload.decode().strip().lower()
-            if payload == "normal" or payload == '1':
-                mode = 1  #normal mode
-            elif payload == "hold" or payload == '2':
-                mode = 2  # Hold mode
-            elif payload == "charge" or payload == '3':
-                mode = 3  # Charge mode
-            elif payload == "selfcontrol" or payload == '4':
-                mode = 4 # self control
-            else:
+            mode = parse_battery_mode(payload)
+            if mode is None:
                 mode = 1  # Default to normal if invalid
                 self.logger.warning(f"[MQTT] Invalid battery mode received: {payload}. Defaulting to 'normal'.")
                 payload = "normal"
             self.controller.set_battery_mode(mode)
             self.client.publish("mmbc/status/batterymode", str(payload).capitalize(), retain=True)
+            self.published_mode = self.controller.mode
             self.logger.info(f"[MQTT] Batterymode set to: {payload}")
     def start(self):
         try:
@@ -110,11 +122,19 @@ class MqttPublisher:
                 "unit": "kWh",
                 "device_class": "energy",
                 "state_class": "total_increasing"
+            },
+            {
+                "name": "Register Drift Events",
+                "key": "drift_events",
+                "unit": "",
+                "device_class": None
             }
         ]
 
         # Combined metrics
         for sensor in sensors:
+            if sensor["key"] == "drift_events":
+                continue  # per-battery only
             topic = f"{HA_DISCOVERY_PREFIX}/sensor/{DEVICE_ID}_{sensor['key']}/config"
             payload = {
                 "name": f"{sensor['name']}",
@@ -186,19 +206,27 @@ class MqttPublisher:
     def _run(self):
         while self.running:
             try:
+                self._publish_mode_if_changed()
                 total_power = 0
                 total_soc = 0
                 count = 0
                 total_charged = 0
                 total_discharged = 0
                 index = 0
+                # publish the controller's last cycle instead of reading the batteries again
+                snapshot = self.controller.last_snapshot
+                if snapshot is None:
+                    time.sleep(self.interval)
+                    continue
                 for battery in self.batteries:
                     index += 1
-                    name = battery.name
-                    soc = battery.get_soc()
-                    power = battery.get_current_wattage()
-                    charged = battery.get_total_charged_kwh()
-                    discharged = battery.get_total_discharged_kwh()
+                    state = snapshot["batteries"].get(battery.name)
+                    if state is None:
+                        continue
+                    soc = state["soc"]
+                    power = int(state["power"])
+                    charged = state["charged_kwh"]
+                    discharged = state["discharged_kwh"]
                     total_soc += soc
                     total_power += power
                     total_charged += charged
@@ -208,6 +236,7 @@ class MqttPublisher:
                     self.client.publish(f"{MQTT_TOPIC_PREFIX}/battery{index}/power", power)
                     self.client.publish(f"{MQTT_TOPIC_PREFIX}/battery{index}/charged_energy", round(charged, 3))
                     self.client.publish(f"{MQTT_TOPIC_PREFIX}/battery{index}/discharged_energy", round(discharged, 3))
+                    self.client.publish(f"{MQTT_TOPIC_PREFIX}/battery{index}/drift_events", int(state.get("drift_events", 0)))
 
                 avg_soc = round(total_soc / count, 2) if count else 0
                 state = "idle"
@@ -221,6 +250,8 @@ class MqttPublisher:
                 self.client.publish(f"{MQTT_TOPIC_PREFIX}/state", state)
                 self.client.publish(f"{MQTT_TOPIC_PREFIX}/charged_energy", round(total_charged, 3))
                 self.client.publish(f"{MQTT_TOPIC_PREFIX}/discharged_energy", round(total_discharged, 3))
+                if snapshot.get("efficiency_saved_kwh") is not None:
+                    self.client.publish(f"{MQTT_TOPIC_PREFIX}/efficiency_saved_energy", round(snapshot["efficiency_saved_kwh"], 3))
 
             except Exception as e:
                 print(f"[MQTT] Error during publish: {e}")
@@ -0,0 +1,282 @@
+import csv
+import math
+import os
+import time
+from bisect import bisect_right
+from datetime import datetime
+from utils.logger import get_logger
+
+# Planned actions per slot
+HOLD = 0
+CHARGE = 1
+DISCHARGE = 2
+ACTION_LABELS = {HOLD: "hold", CHARGE: "charge", DISCHARGE: "discharge"}
+
+
+def _parse_timestamp(value: str) -> float:
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def load_price_file(path: str) -> list[tuple[float, float, float]]:
+    """
+    Read a tariff CSV with the columns timestamp,price[,export_price].
+    Prices are per kWh and valid from their timestamp until the next row.
+    Timestamps are epoch seconds or ISO 8601.
+    """
+    rows = []
+    with open(path, newline="") as f:
+        for line in csv.reader(f):
+            if not line or line[0].startswith("#") or line[0].strip() == "timestamp":
+                continue
+            price = float(line[1])
+            export_price = float(line[2]) if len(line) > 2 and line[2].strip() else price
+            rows.append((_parse_timestamp(line[0]), price, export_price))
+    rows.sort()
+    return rows
+
+
+def load_forecast_file(path: str) -> list[tuple[float, float]]:
+    """
+    Read a forecast CSV with the columns timestamp,net_load_w where net_load_w
+    is household load minus PV (positive = the house needs power).
+    """
+    rows = []
+    with open(path, newline="") as f:
+        for line in csv.reader(f):
+            if not line or line[0].startswith("#") or line[0].strip() == "timestamp":
+                continue
+            rows.append((_parse_timestamp(line[0]), float(line[1])))
+    rows.sort()
+    return rows
+
+
+def _step_value(rows: list, ts: float, default):
+    """Value of the last row starting at or before ts."""
+    i = bisect_right(rows, (ts, math.inf))
+    return rows[i - 1][1:] if i else default
+
+
+class SchedulePlanner:
+    """
+    Plans charge / hold / discharge per time slot for all batteries together.
+
+    The batteries are modelled as one pool whose stored energy is discretised
+    into soc_steps states. A backward dynamic program computes, for every slot
+    and every state, the cheapest action given the prices and the load/PV
+    forecast (or a nominal household load when there is no forecast). The value table of each slot is cached with the inputs it was
+    computed from, so a re-plan only recomputes the slots at or before the last
+    slot whose inputs changed. The resulting policy is indexed by the actual
+    pool SoC, so the plan stays valid when the batteries drift from it.
+    """
+
+    def __init__(self, price_file: str, forecast_file: str | None, battery_count: int,
+                 capacity_wh: float = 5120, max_power: int = 2500, min_soc: float = 11,
+                 max_soc: float = 100, efficiency: float = 0.9, slot_seconds: int = 900,
+                 horizon_hours: int = 48, soc_steps: int = 100, check_interval: int = 60,
+                 nominal_load_w: float = 300):
+        self.price_file = price_file
+        self.forecast_file = forecast_file
+        self.battery_count = battery_count
+        self.slot_seconds = slot_seconds
+        self.horizon = horizon_hours * 3600
+        self.soc_steps = soc_steps
+        self.check_interval = check_interval
+        # net load assumed for slots without a forecast; without any load the
+        # planner would never see a reason to discharge
+        self.nominal_load_w = nominal_load_w
+        if not 0 < soc_steps < 256:
+            raise ValueError("soc_steps must be between 1 and 255")
+        self.capacity_total = battery_count * capacity_wh
+        self.energy_min = battery_count * capacity_wh * min_soc / 100
+        self.energy_max = battery_count * capacity_wh * max_soc / 100
+        self.energy_step = (self.energy_max - self.energy_min) / soc_steps
+        self.slot_power_wh = battery_count * max_power * slot_seconds / 3600
+        # split the round-trip efficiency evenly over charging and discharging
+        self.charge_efficiency = math.sqrt(efficiency)
+        self.discharge_efficiency = math.sqrt(efficiency)
+
+        self.prices = []
+        self.forecast = []
+        self.input_mtimes = None
+        self.last_check = 0
+        self.plan_end = None
+        # slot start -> (inputs, value table, policy, next state) as of the last plan
+        self.cache = {}
+        self.logger = get_logger('Planner')
+        if not forecast_file:
+            self.logger.warning(f"No forecast file set. Planning with a constant household load of {nominal_load_w:.0f}W")
+
+    def _refresh_inputs(self) -> bool:
+        mtimes = (os.path.getmtime(self.price_file),
+                  os.path.getmtime(self.forecast_file) if self.forecast_file else None)
+        if mtimes == self.input_mtimes:
+            return False
+        self.prices = load_price_file(self.price_file)
+        self.forecast = load_forecast_file(self.forecast_file) if self.forecast_file else []
+        self.input_mtimes = mtimes
+        self.logger.info(f"Loaded {len(self.prices)} prices and {len(self.forecast)} forecast points")
+        return True
+
+    def _horizon_end(self, now: float) -> float:
+        if not self.prices:
+            return now
+        # the last price row is valid for one slot
+        price_end = self.prices[-1][0] + self.slot_seconds
+        # align the cap to a day boundary so the terminal slot (and with it the
+        # whole value table) does not move every slot
+        cap = now + self.horizon
+        cap -= cap % 86400
+        return min(price_end, max(cap, now + self.slot_seconds))
+
+    def _slot_inputs(self, ts: float) -> tuple[float, float, float]:
+        price, export_price = _step_value(self.prices, ts, (0.0, 0.0))
+        (load,) = _step_value(self.forecast, ts, (self.nominal_load_w,))
+        return price, export_price, load
+
+    def plan(self, now: float | None = None) -> int:
+        """(Re)compute the policy for the current horizon. Returns the number of slots solved."""
+        now = time.time() if now is None else now
+        if not self.prices:
+            # no tariff means no plan, not free energy
+            self.cache = {}
+            self.plan_end = None
+            return 0
+        # slots before the first price row have no known tariff: leave them unplanned
+        first = now - now % self.slot_seconds
+        first_priced = self.prices[0][0] - self.prices[0][0] % self.slot_seconds
+        first = max(first, first_priced)
+        end = self._horizon_end(now)
+        slots = []
+        ts = first
+        while ts < end:
+            slots.append(ts)
+            ts += self.slot_seconds
+        if not slots:
+            self.cache = {}
+            self.plan_end = None
+            return 0
+
+        inputs = [self._slot_inputs(ts) for ts in slots]
+        # walk back from the end while the inputs are unchanged;
+        # everything after it keeps its cached value table
+        resume = len(slots)
+        if end == self.plan_end:
+            while resume > 0:
+                cached = self.cache.get(slots[resume - 1])
+                if cached is None or cached[0] != inputs[resume - 1]:
+                    break
+                resume -= 1
+        else:
+            resume = len(slots)
+
+        if resume < len(slots):
+            value = self.cache[slots[resume]][1]
+        else:
+            value = self._terminal_value(inputs[-1][0])
+
+        cache = {ts: self.cache[ts] for ts in slots[resume:]}
+        for i in range(resume - 1, -1, -1):
+            value, policy, landing = self._solve_slot(inputs[i], value)
+            cache[slots[i]] = (inputs[i], value, policy, landing)
+        self.cache = cache
+        self.plan_end = end
+        return resume
+
+    def _terminal_value(self, price: float) -> list[float]:
+        # energy left at the end of the horizon is worth what it saves at the last price
+        return [-(s * self.energy_step) * self.discharge_efficiency * price / 1000
+                for s in range(self.soc_steps + 1)]
+
+    def _solve_slot(self, inputs: tuple, next_value: list[float]) -> tuple[list[float], bytes, bytes]:
+        price, export_price, load_w = inputs
+        load_wh = load_w * self.slot_seconds / 3600
+        surplus_wh = max(0.0, -load_wh)
+        step = self.energy_step
+        top = self.soc_steps
+        eta_c = self.charge_efficiency
+        eta_d = self.discharge_efficiency
+        limit_wh = self.slot_power_wh
+
+        def cost(grid_wh: float) -> float:
+            return grid_wh * (price if grid_wh > 0 else export_price) / 1000
+
+        def evaluate(delta_wh: list[float], grid_wh: list[float]) -> tuple[list[float], list[float]]:
+            # next states are fractional, so interpolate the next value table
+            # instead of rounding small flows away
+            positions = [min(top, max(0.0, s + d / step)) for s, d in zip(states, delta_wh)]
+            lows = [int(p) for p in positions]
+            totals = [cost(g) + next_value[i] + (next_value[min(i + 1, top)] - next_value[i]) * (p - i)
+                      for g, p, i in zip(grid_wh, positions, lows)]
+            return totals, positions
+
+        states = range(top + 1)
+        room = [(top - s) * step for s in states]
+        stored = [s * step for s in states]
+
+        # hold: only absorb PV surplus
+        hold_in = [min(min(surplus_wh, limit_wh) * eta_c, r) for r in room]
+        hold = evaluate(hold_in, [load_wh + e / eta_c for e in hold_in])
+
+        # charge: full power from the grid
+        charge_in = [min(limit_wh * eta_c, r) for r in room]
+        charge = evaluate(charge_in, [load_wh + e / eta_c for e in charge_in])
+
+        # discharge (normal mode): cover the load, absorb surplus
+        if load_wh > 0:
+            discharge_out = [min(min(load_wh, limit_wh) / eta_d, a) for a in stored]
+            discharge = evaluate([-e for e in discharge_out], [load_wh - e * eta_d for e in discharge_out])
+        else:
+            discharge = hold
+
+        value = []
+        policy = bytearray(top + 1)
+        landing = bytearray(top + 1)
+        for s, h, c, d in zip(states, hold[0], charge[0], discharge[0]):
+            if c < h and c < d:
+                best, v, position = CHARGE, c, charge[1][s]
+            elif d < h:
+                best, v, position = DISCHARGE, d, discharge[1][s]
+            else:
+                best, v, position = HOLD, h, hold[1][s]
+            value.append(v)
+            policy[s] = best
+            landing[s] = round(position)
+        return value, bytes(policy), bytes(landing)
+
+    def _state_for(self, socs: list[float]) -> int:
+        avg_soc = sum(socs) / len(socs) if socs else 0
+        energy = self.capacity_total * avg_soc / 100
+        return max(0, min(self.soc_steps, round((energy - self.energy_min) / self.energy_step)))
+
+    def action_for(self, now: float, socs: list[float]) -> int | None:
+        """Return the planned action for the current slot, or None if there is no plan."""
+        if now - self.last_check >= self.check_interval:
+            self.last_check = now
+            try:
+                changed = self._refresh_inputs()
+            except Exception as e:
+                self.logger.error(f"Failed to read planner inputs: {e}")
+                changed = False
+            if changed or self._horizon_end(now) != self.plan_end:
+                started = time.perf_counter()
+                solved = self.plan(now)
+                self.logger.info(f"Re-planned {solved} of {len(self.cache)} slots in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+        entry = self.cache.get(now - now % self.slot_seconds)
+        if entry is None:
+            return None
+        return entry[2][self._state_for(socs)]
+
+    def schedule(self, socs: list[float]) -> list[tuple[float, str]]:
+        """The planned action per slot, assuming the batteries follow the plan from their current SoC."""
+        result = []
+        state = self._state_for(socs)
+        for ts in sorted(self.cache):
+            _, _, policy, landing = self.cache[ts]
+            result.append((ts, ACTION_LABELS[policy[state]]))
+            state = landing[state]
+        return result
@@ -0,0 +1,173 @@
+import math
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from utils.logger import get_logger
+
+# written snapshots, mode command sequence, requested mode, battery count, slot count
+HEADER = struct.Struct("<QQiII4x")
+BATTERY_FIELDS = ("soc", "power", "setpoint", "charged_kwh", "discharged_kwh", "drift_events")
+
+
+def _record_struct(battery_count: int) -> struct.Struct:
+    # sequence, ts, mode, net power, adjusted power, efficiency saving (NaN when
+    # off), then the battery fields
+    return struct.Struct("<Qdi4xddd" + "d" * len(BATTERY_FIELDS) * battery_count)
+
+
+class SnapshotRing:
+    """
+    Single-producer ring buffer of controller snapshots in shared memory.
+
+    The control process writes one fixed-size record per cycle; any number of
+    readers in other processes unpack records straight from the shared buffer.
+    Every slot carries a sequence number that is odd while the slot is being
+    written, so readers can detect and skip records that were overwritten
+    under them. The header also holds a one-slot mode command channel for the
+    opposite direction.
+    """
+
+    def __init__(self, battery_names: list[str], slots: int = 64, name: str | None = None):
+        self.battery_names = list(battery_names)
+        self.record = _record_struct(len(self.battery_names))
+        self.slots = slots
+        size = HEADER.size + self.record.size * slots
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        if self.owner:
+            HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, len(self.battery_names), slots)
+        else:
+            _, _, _, battery_count, slots = HEADER.unpack_from(self.shm.buf, 0)
+            if battery_count != len(self.battery_names) or slots != self.slots:
+                raise ValueError("Shared snapshot ring does not match this configuration")
+        self.last_command = 0
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + (index % self.slots) * self.record.size
+
+    def write(self, snapshot: dict) -> None:
+        """Append a snapshot. Only one process may write."""
+        buf = self.shm.buf
+        written = struct.unpack_from("<Q", buf, 0)[0]
+        offset = self._offset(written)
+        values = []
+        for name in self.battery_names:
+            battery = snapshot["batteries"].get(name, {})
+            values += [float(battery.get(field) or 0) for field in BATTERY_FIELDS]
+        struct.pack_into("<Q", buf, offset, 2 * written + 1)
+        saved = snapshot.get("efficiency_saved_kwh")
+        self.record.pack_into(buf, offset, 2 * written + 1, snapshot["ts"], snapshot["mode"],
+                              snapshot["net_power"], snapshot["adjusted_power"],
+                              math.nan if saved is None else saved, *values)
+        struct.pack_into("<Q", buf, offset, 2 * written + 2)
+        struct.pack_into("<Q", buf, 0, written + 1)
+
+    def written(self) -> int:
+        return struct.unpack_from("<Q", self.shm.buf, 0)[0]
+
+    def read(self, index: int) -> dict | None:
+        """Return snapshot number index, or None if it was overwritten while reading."""
+        buf = self.shm.buf
+        offset = self._offset(index)
+        fields = self.record.unpack_from(buf, offset)
+        if fields[0] != 2 * index + 2 or struct.unpack_from("<Q", buf, offset)[0] != fields[0]:
+            return None
+        _, ts, mode, net_power, adjusted_power, saved = fields[:6]
+        batteries = {}
+        width = len(BATTERY_FIELDS)
+        for i, name in enumerate(self.battery_names):
+            values = fields[6 + i * width:6 + (i + 1) * width]
+            batteries[name] = dict(zip(BATTERY_FIELDS, values))
+        return {"ts": ts, "mode": mode, "net_power": net_power, "adjusted_power": adjusted_power,
+                "efficiency_saved_kwh": None if math.isnan(saved) else saved, "batteries": batteries}
+
+    def request_mode(self, mode: int) -> None:
+        """Ask the control process to switch battery mode."""
+        buf = self.shm.buf
+        struct.pack_into("<i", buf, 16, mode)
+        struct.pack_into("<Q", buf, 8, struct.unpack_from("<Q", buf, 8)[0] + 1)
+
+    def take_mode_request(self) -> int | None:
+        """Return a newly requested battery mode, if any."""
+        command = struct.unpack_from("<Q", self.shm.buf, 8)[0]
+        if command == self.last_command:
+            return None
+        self.last_command = command
+        return struct.unpack_from("<i", self.shm.buf, 16)[0]
+
+
+class RemoteBattery:
+    """Name-only stand-in for a battery that lives in the control process."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class RemoteController:
+    """
+    Stand-in for the Controller in the sink process. Exposes the attributes
+    the sinks use and forwards mode changes to the control process.
+    """
+
+    def __init__(self, ring: SnapshotRing, interval: float, self_control_available: bool, initial_mode: int):
+        self.ring = ring
+        self.batteries = [RemoteBattery(name) for name in ring.battery_names]
+        self.interval = interval
+        self.self_control_available = self_control_available
+        self.mode = initial_mode
+        self.last_snapshot = None
+        self.listeners = []
+        self.mode_requested_at = 0
+        self.running = False
+        self.thread = None
+        self.logger = get_logger('RemoteController')
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def set_battery_mode(self, mode: int):
+        self.ring.request_mode(mode)
+        self.mode = mode
+        self.mode_requested_at = time.time()
+
+    def run_forever(self):
+        """Feed every new snapshot from the ring to the listeners."""
+        self.running = True
+        next_index = self.ring.written()
+        while self.running:
+            written = self.ring.written()
+            if written - next_index > self.ring.slots:
+                self.logger.warning(f"Sinks fell behind, skipped {written - next_index - self.ring.slots} snapshots")
+                next_index = written - self.ring.slots
+            for index in range(next_index, written):
+                snapshot = self.ring.read(index)
+                if snapshot is None:
+                    continue
+                self.last_snapshot = snapshot
+                # the control process applies a request after the cycle that is in progress
+                if snapshot["ts"] > self.mode_requested_at + self.interval:
+                    self.mode = snapshot["mode"]
+                for callback in self.listeners:
+                    try:
+                        callback(snapshot)
+                    except Exception as e:
+                        self.logger.error(f"Snapshot listener failed: {e}")
+            next_index = written
+            time.sleep(min(self.interval, 0.5) / 2)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop reading the ring. Call before the ring is closed."""
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
@@ -0,0 +1,199 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import threading
+from utils.logger import get_logger
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_CLIENT_BUFFER = 256 * 1024  # drop subscribers that fall this far behind
+MAX_CLIENT_FRAME = 125  # subscribers only send control frames, which are at most 125 bytes
+
+
+def diff(old, new) -> dict:
+    """
+    JSON merge patch (RFC 7386) turning old into new: changed keys carry the
+    new value, removed keys are set to None.
+    """
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = diff(old[key], value)
+            if nested:
+                patch[key] = nested
+        elif old[key] != value:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+class StateServer:
+    """
+    Embedded HTTP + WebSocket server for the latest controller snapshot.
+
+        GET /state   the snapshot as JSON, with ETag / If-None-Match support
+        GET /ws      WebSocket: the full snapshot on connect, then one merge
+                     patch per control cycle
+
+    Everything is served from memory: the snapshot is encoded once per cycle
+    and the same bytes go to every client, so clients never cause Modbus or
+    meter I/O.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.snapshot = None
+        self.version = 0
+        # the version restarts at 0 on every start; the boot id keeps ETags
+        # from before a restart from matching new versions
+        self.boot_id = os.urandom(4).hex()
+        self.body = b"null"
+        self.etag = f'"{self.boot_id}-0"'
+        self.subscribers = set()
+        self.logger = get_logger('StateServer')
+
+    def start(self) -> None:
+        started = threading.Event()
+
+        def _run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            except Exception as e:
+                # leave self.loop unset so publish() does not queue snapshots nobody serves
+                self.logger.error(f"Failed to start state server on {self.host}:{self.port}: {e}")
+                loop.close()
+                started.set()
+                return
+            self.loop = loop
+            self.logger.info(f"State server listening on {self.host}:{self.port}")
+            started.set()
+            loop.run_until_complete(server.serve_forever())
+
+        threading.Thread(target=_run, daemon=True).start()
+        started.wait(5)
+
+    def publish(self, snapshot: dict) -> None:
+        """Controller listener. Safe to call from any thread."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._update, snapshot)
+
+    def _update(self, snapshot: dict) -> None:
+        patch = diff(self.snapshot, snapshot) if self.snapshot is not None else snapshot
+        if not patch:
+            return
+        self.snapshot = snapshot
+        self.version += 1
+        self.body = json.dumps(snapshot).encode()
+        self.etag = f'"{self.boot_id}-{self.version}"'
+
+        if not self.subscribers:
+            return
+        frame = _ws_frame(json.dumps({"type": "delta", "version": self.version, "data": patch}).encode())
+        for writer in list(self.subscribers):
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                self.logger.warning("WebSocket subscriber is not keeping up. Disconnecting it.")
+                self.subscribers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                lines = request.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+
+                if method != "GET":
+                    self._respond(writer, "405 Method Not Allowed")
+                elif path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    return
+                elif path == "/state":
+                    if headers.get("if-none-match") == self.etag:
+                        self._respond(writer, "304 Not Modified", etag=self.etag)
+                    else:
+                        self._respond(writer, "200 OK", self.body, etag=self.etag)
+                else:
+                    self._respond(writer, "404 Not Found")
+
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: str, body: bytes = b"", etag: str | None = None) -> None:
+        head = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nCache-Control: no-cache\r\n"
+        if body:
+            head += "Content-Type: application/json\r\n"
+        if etag:
+            head += f"ETag: {etag}\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+
+    async def _websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict) -> None:
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        writer.write(_ws_frame(b'{"type": "snapshot", "version": ' + str(self.version).encode() + b', "data": ' + self.body + b"}"))
+        self.subscribers.add(writer)
+        try:
+            # only control frames are expected from subscribers
+            while True:
+                first, second = await reader.readexactly(2)
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    (length,) = struct.unpack("!H", await reader.readexactly(2))
+                elif length == 127:
+                    (length,) = struct.unpack("!Q", await reader.readexactly(8))
+                if length > MAX_CLIENT_FRAME:
+                    self.logger.warning(f"Closing WebSocket client that sent a {length} byte frame")
+                    writer.write(_ws_frame(struct.pack("!H", 1009), opcode=0x8))  # message too big
+                    break
+                mask = await reader.readexactly(4) if second & 0x80 else b"\x00\x00\x00\x00"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                if opcode == 0x8:
+                    writer.write(_ws_frame(payload[:2], opcode=0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, opcode=0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
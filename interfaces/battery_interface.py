@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 
 class BatteryInterface(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def get_soc(self) -> float:
         """Return the state of charge as a percentage (0.0 to 100.0)."""
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 
 class MeterInterface(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def get_net_power(self) -> int:
         """
@@ -0,0 +1,45 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlparse
+from utils.logger import get_logger
+
+
+class AsyncHomeWizardP1Meter:
+    """asyncio counterpart of HomeWizardP1Meter, used by fleet mode."""
+
+    def __init__(self, host: str, timeout: float = 2):
+        url = urlparse(host if "://" in host else f"http://{host}")
+        self.hostname = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.last_known_power = 0
+        self.last_update = None  # time of the last successful reading
+        self.logger = get_logger('AsyncP1Meter')
+
+    async def _fetch(self) -> dict:
+        reader, writer = await asyncio.open_connection(self.hostname, self.port)
+        try:
+            # HTTP/1.0 keeps the response unchunked and closes the connection
+            writer.write(f"GET /api/v1/data HTTP/1.0\r\nHost: {self.hostname}\r\n\r\n".encode())
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        status = head.split(b"\r\n", 1)[0]
+        if b" 200 " not in status + b" ":
+            raise ValueError(f"Unexpected response: {status.decode(errors='replace')}")
+        return json.loads(body)
+
+    async def get_net_power(self) -> int:
+        try:
+            data = await asyncio.wait_for(self._fetch(), self.timeout)
+            if "active_power_w" in data:
+                self.last_known_power = int(data["active_power_w"])
+                self.last_update = time.time()
+                return self.last_known_power
+
+            raise ValueError("No usable power field found in P1 data")
+        except Exception as e:
+            self.logger.warning(f"Error reading data: {e}. Using last known value: {self.last_known_power}W")
+            return self.last_known_power
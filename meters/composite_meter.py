@@ -0,0 +1,102 @@
+import threading
+import time
+from interfaces.meter_interface import MeterInterface
+from utils.logger import get_logger
+
+
+class MeterSource:
+    def __init__(self, meter: MeterInterface, name: str, weight: float = 1.0, sign: int = 1, max_age: float = 10.0):
+        """
+        meter: the underlying meter
+        weight: scale factor applied to the meter's reading
+        sign: +1 or -1, e.g. -1 for a PV inverter that reports production as positive
+        max_age: readings older than this (seconds) are dropped from the fused value
+        """
+        if sign not in (1, -1):
+            raise ValueError(f"sign must be 1 or -1, got {sign}")
+        self.meter = meter
+        self.name = name
+        self.weight = weight
+        self.sign = sign
+        self.max_age = max_age
+        self.sample = None  # (timestamp, watts) of the newest reading
+        self.stale = True  # until the first reading arrives
+        self.failing = False
+
+
+class CompositeMeter(MeterInterface):
+    """
+    Fuses several meters into one net-power value.
+
+    Every source is polled from its own thread, so a slow source never delays
+    the others or the controller. The fused value is the weighted sum of every
+    fresh source's latest reading, timestamped at the newest of them, so a
+    slow source never makes the fused reading older. How far each source lags
+    behind that timestamp is kept in skew. Sources that have not reported
+    within their max_age are left out until they recover.
+    """
+
+    def __init__(self, sources: list[MeterSource], poll_interval: float = 1.0):
+        if not sources:
+            raise ValueError("CompositeMeter needs at least one source")
+        self.sources = sources
+        self.poll_interval = poll_interval
+        self.last_known_power = 0
+        self.skew = {}  # source name -> seconds behind the fused timestamp
+        self.lock = threading.Lock()
+        self.logger = get_logger('CompositeMeter')
+        for source in self.sources:
+            threading.Thread(target=self._poll, args=(source,), daemon=True).start()
+
+    def _poll(self, source: MeterSource):
+        while True:
+            started = time.time()
+            try:
+                value = source.meter.get_net_power()
+                # meters that fall back to a cached value expose when it was really read
+                ts = getattr(source.meter, "last_update", started)
+                with self.lock:
+                    if ts is not None and (source.sample is None or ts > source.sample[0]):
+                        source.sample = (ts, value)
+                if source.failing:
+                    source.failing = False
+                    self.logger.info(f"[{source.name}] Meter readable again.")
+            except Exception as e:
+                # log transitions only; get_reading() reports the source as stale
+                if not source.failing:
+                    source.failing = True
+                    self.logger.warning(f"[{source.name}] Error reading meter: {e}")
+            time.sleep(max(0.0, self.poll_interval - (time.time() - started)))
+
+    def get_reading(self) -> tuple[int, float | None]:
+        """Return (fused net power in W, age of the aligned reading in seconds)."""
+        now = time.time()
+        with self.lock:
+            fresh = []
+            for source in self.sources:
+                is_fresh = source.sample is not None and now - source.sample[0] <= source.max_age
+                if is_fresh == source.stale:
+                    # log transitions only, not every cycle
+                    source.stale = not is_fresh
+                    if source.stale:
+                        self.logger.warning(f"[{source.name}] No reading for {source.max_age}s. Dropping it from the fused value.")
+                    else:
+                        self.logger.info(f"[{source.name}] Receiving readings.")
+                if is_fresh:
+                    fresh.append((source, source.sample))
+
+        if not fresh:
+            self.logger.warning(f"No fresh meter readings. Using last known value: {self.last_known_power}W")
+            return self.last_known_power, None
+
+        newest = max(ts for _, (ts, _) in fresh)
+        total = 0.0
+        for source, (ts, value) in fresh:
+            total += source.sign * source.weight * value
+        self.skew = {source.name: newest - ts for source, (ts, _) in fresh}
+        self.last_known_power = int(round(total))
+        return self.last_known_power, now - newest
+
+    def get_net_power(self) -> int:
+        power, _ = self.get_reading()
+        return power
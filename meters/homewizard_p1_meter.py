@@ -1,3 +1,4 @@
+import time
 import requests
 from interfaces.meter_interface import MeterInterface
 from utils.logger import get_logger
@@ -6,6 +7,7 @@ class HomeWizardP1Meter(MeterInterface):
     def __init__(self, host: str):
         self.url = f"{host}/api/v1/data"
         self.last_known_power = 0
+        self.last_update = None  # time of the last successful reading
         self.logger = get_logger('P1Meter')
 
     def get_net_power(self) -> int:
@@ -16,6 +18,7 @@ class HomeWizardP1Meter(MeterInterface):
 
             if "active_power_w" in data:
                 self.last_known_power = int(data["active_power_w"])
+                self.last_update = time.time()
                 return self.last_known_power
 
             raise ValueError("No usable power field found in P1 data")
@@ -1,9 +1,17 @@
 import signal
 import sys
-from core.controller import Controller
+import multiprocessing
+from core.controller import Controller, BATTERY_NORMAL
+from core.planner import SchedulePlanner
+from core.efficiency import EfficiencyModel
 from meters.homewizard_p1_meter import HomeWizardP1Meter
+from meters.composite_meter import CompositeMeter, MeterSource
 from batteries.venus_battery import VenusBattery
 from core.mqtt_publisher import MqttPublisher
+from core.history_store import HistoryStore, HistoryServer
+from core.state_server import StateServer
+from core.snapshot_ring import SnapshotRing, RemoteController
+from core.fleet import run_fleet
 import os
 from dotenv import load_dotenv
 from utils.logger import get_logger
@@ -11,59 +19,181 @@ from core.config_loader import get_config_value
 
 load_dotenv()
 
+INTERVAL_SECONDS = 3
+logger = get_logger('MMBC')
+controller = None
+control_process = None
+ring = None
+remote = None
+history = None
+
 def handle_shutdown(signum, frame):
     print("Shutting down gracefully...")
-    controller.shutdown_all()
+    if control_process:
+        # the control process releases the batteries itself
+        control_process.terminate()
+        control_process.join(10)
+        if remote:
+            remote.stop()  # the reader thread must be done with the ring before it is closed
+        ring.close()
+    elif controller:
+        controller.shutdown_all()
+    if history:
+        history.save_now()
     sys.exit(0)
 
-if __name__ == "__main__":
-    logger = get_logger('MMBC')
-    logger.info("Starting MMBC (Multi Meter Battery Controller) Version 1.1.2...")
-    signal.signal(signal.SIGINT, handle_shutdown)
-    signal.signal(signal.SIGTERM, handle_shutdown)
-    # Real HomeWizard P1 meter
-    meter_ip = get_config_value("P1_HOST")
+def battery_configs() -> list[dict]:
     battery_1_ip = get_config_value("BATTERY_1_IP")
     battery_1_address = int(get_config_value("BATTERY_1_ADDRESS"))
     battery_1_port = int(get_config_value("BATTERY_1_PORT", 502))  # Default port is 502 if not set
     if not battery_1_ip or not battery_1_address:
         raise ValueError("BATTERY_1_IP and BATTERY_1_ADDRESS environment variables must be set.")
+    configs = [dict(ip=battery_1_ip, unit_id=battery_1_address, name="VenusBattery1", port=battery_1_port)]
 
     battery_2_ip = get_config_value("BATTERY_2_IP")
     battery_2_address = int(get_config_value("BATTERY_2_ADDRESS",0))
     battery_2_port = int(get_config_value("BATTERY_2_PORT", 502))  # Default port is 502 if not set
-    battery_2_present = False
     if not battery_2_ip or not battery_2_address:
         logger.info('BATTERY_2_IP and BATTERY_2_ADDRESS environment variables not set. Skipping battery 2.')
-    else: 
+    else:
         logger.info(f'BATTERY_2_IP and BATTERY_2_ADDRESS environment variables set. Battery 2 will be used.')
-        battery_2_present = True
+        configs.append(dict(ip=battery_2_ip, unit_id=battery_2_address, name="VenusBattery2", port=battery_2_port))
     battery_3_ip = get_config_value("BATTERY_3_IP")
     battery_3_address = int(get_config_value("BATTERY_3_ADDRESS",0))
     battery_3_port = int(get_config_value("BATTERY_3_PORT", 502))  # Default port is 502 if not set
-    battery_3_present = False
     if not battery_3_ip or not battery_3_address:
         logger.info('BATTERY_3_IP and BATTERY_3_ADDRESS environment variables not set. Skipping battery 3.')
-    else: 
+    else:
         logger.info(f'BATTERY_3_IP and BATTERY_3_ADDRESS environment variables set. Battery 3 will be used.')
-        battery_3_present = True
+        configs.append(dict(ip=battery_3_ip, unit_id=battery_3_address, name="VenusBattery3", port=battery_3_port))
+    return configs
+
+def build_meter():
+    # Real HomeWizard P1 meter
+    meter_ip = get_config_value("P1_HOST")
     if not meter_ip:
         logger.info('P1_HOST environment variable not set. Not using HomeWizard P1 meter.')
         #raise ValueError("P1_HOST environment variable not set. Please set it to your HomeWizard P1 meter's IP address.")
         meter = None
     else:
         meter = HomeWizardP1Meter(host=meter_ip)
-    
-    batteries = [
-        VenusBattery(ip=battery_1_ip, unit_id=battery_1_address, name="VenusBattery1",port=battery_1_port)
-    ]
-    if battery_2_present:
-        batteries.append(VenusBattery(ip=battery_2_ip, unit_id=battery_2_address, name="VenusBattery2",port=battery_2_port))
-    if battery_3_present:
-        batteries.append(VenusBattery(ip=battery_3_ip, unit_id=battery_3_address, name="VenusBattery3",port=battery_3_port))
-   
-    self_control_available = get_config_value("SELF_CONTROL_AVAILABLE", "true").lower() == "true"
-    controller = Controller(meter=meter, batteries=batteries, interval_seconds=3, self_control_available=self_control_available)
-    mqtt = MqttPublisher(controller,batteries=batteries, interval=3)
+
+    # Optional sub-meters (SUBMETER_1_HOST, SUBMETER_2_HOST, ...) are fused with the P1 meter
+    meter_max_age = float(get_config_value("METER_MAX_AGE", 10))
+    meter_sources = []
+    index = 1
+    while get_config_value(f"SUBMETER_{index}_HOST"):
+        meter_sources.append(MeterSource(
+            HomeWizardP1Meter(host=get_config_value(f"SUBMETER_{index}_HOST")),
+            name=f"Submeter{index}",
+            weight=float(get_config_value(f"SUBMETER_{index}_WEIGHT", 1.0)),
+            sign=int(get_config_value(f"SUBMETER_{index}_SIGN", 1)),
+            max_age=meter_max_age,
+        ))
+        index += 1
+    if meter_sources:
+        if meter:
+            meter_sources.insert(0, MeterSource(meter, name="P1", max_age=meter_max_age))
+        logger.info(f'{len(meter_sources)} meters configured. Using a composite meter.')
+        meter = CompositeMeter(meter_sources)
+    return meter
+
+def build_controller(configs: list[dict]) -> Controller:
+    meter = build_meter()
+    reconcile_interval = int(get_config_value("RECONCILE_INTERVAL", 60))
+    batteries = [VenusBattery(**config, reconcile_interval=reconcile_interval) for config in configs]
+
+    planner = None
+    price_file = get_config_value("PLANNER_PRICE_FILE")
+    if price_file:
+        planner = SchedulePlanner(
+            price_file=price_file,
+            forecast_file=get_config_value("PLANNER_FORECAST_FILE"),
+            battery_count=len(batteries),
+            capacity_wh=float(get_config_value("PLANNER_CAPACITY_WH", 5120)),
+            efficiency=float(get_config_value("PLANNER_EFFICIENCY", 0.9)),
+            horizon_hours=int(get_config_value("PLANNER_HORIZON_HOURS", 48)),
+            nominal_load_w=float(get_config_value("PLANNER_NOMINAL_LOAD_W", 300)),
+        )
+        logger.info(f"Schedule planner enabled with prices from {price_file}")
+
+    efficiency = None
+    if get_config_value("EFFICIENCY_MODEL", "false").lower() == "true":
+        efficiency = EfficiencyModel()
+        logger.info("Efficiency model enabled. Power is split by learned loss curves once they have enough samples.")
+    return Controller(meter=meter, batteries=batteries, interval_seconds=INTERVAL_SECONDS, self_control_available=self_control_available(), planner=planner, efficiency=efficiency, meter_max_age=float(get_config_value("METER_MAX_AGE", 10)))
+
+def self_control_available() -> bool:
+    return get_config_value("SELF_CONTROL_AVAILABLE", "true").lower() == "true"
+
+def start_sinks(source):
+    """Attach history, state server and MQTT to a Controller or RemoteController."""
+    global history
+    history = HistoryStore([b.name for b in source.batteries], interval_seconds=source.interval)
+    source.add_listener(history.record)
+    logger.info(f"History store allocated ({history.memory_bytes() // 1024} KiB)")
+    history_file = get_config_value("HISTORY_FILE")
+    if history_file:
+        history.start_persistence(history_file, interval=int(get_config_value("HISTORY_SAVE_INTERVAL", 300)))
+    history_port = get_config_value("HISTORY_PORT")
+    if history_port:
+        HistoryServer(history, port=int(history_port)).start()
+
+    state_server_port = get_config_value("STATE_SERVER_PORT")
+    if state_server_port:
+        state_server = StateServer(port=int(state_server_port))
+        state_server.start()
+        source.add_listener(state_server.publish)
+
+    mqtt = MqttPublisher(source, batteries=source.batteries, interval=INTERVAL_SECONDS)
     mqtt.start()
+
+def run_control_process(ring: SnapshotRing, configs: list[dict]):
+    global controller, control_process
+    control_process = None  # inherited from the parent by fork
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    controller = build_controller(configs)
+
+    def forward(snapshot):
+        ring.write(snapshot)
+        mode = ring.take_mode_request()
+        if mode is not None:
+            controller.set_battery_mode(mode)
+
+    controller.add_listener(forward)
     controller.run_forever()
+
+if __name__ == "__main__":
+    logger.info("Starting MMBC (Multi Meter Battery Controller) Version 1.1.2...")
+    signal.signal(signal.SIGINT, handle_shutdown)
+    signal.signal(signal.SIGTERM, handle_shutdown)
+
+    fleet_file = get_config_value("FLEET_FILE")
+    if fleet_file:
+        # many sites in this process, configured from a JSON file
+        run_fleet(fleet_file)
+        sys.exit(0)
+
+    configs = battery_configs()
+
+    if get_config_value("MULTIPROCESS", "false").lower() == "true":
+        # control loop in a child process, sinks in this one
+        ring = SnapshotRing([config["name"] for config in configs])
+        control_process = multiprocessing.get_context("fork").Process(
+            target=run_control_process, args=(ring, configs), name="mmbc-control")
+        control_process.start()
+        logger.info(f"Control loop running in process {control_process.pid}")
+        remote = RemoteController(ring, interval=INTERVAL_SECONDS, self_control_available=self_control_available(), initial_mode=BATTERY_NORMAL)
+        start_sinks(remote)
+        remote.start()
+        control_process.join()
+        logger.error(f"Control process exited with code {control_process.exitcode}")
+        remote.stop()
+        ring.close()
+        history.save_now()
+        sys.exit(1)
+    else:
+        controller = build_controller(configs)
+        start_sinks(controller)
+        controller.run_forever()
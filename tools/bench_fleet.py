@@ -0,0 +1,188 @@
+"""
+Benchmark for fleet mode: memory per site and CPU per site cycle.
+
+Runs N sites in one FleetRuntime and reports the memory allocated per site
+and the CPU time the process spent per site cycle.
+
+By default the sites use fake drivers with simulated network latency. With
+--real-drivers every site uses the real AsyncVenusBattery (one
+AsyncModbusTcpClient per battery) and AsyncHomeWizardP1Meter against local
+Modbus TCP and HTTP stubs, so the driver overhead is part of the numbers.
+Memory is measured after a warm-up run, once the connections are open, and
+the driver share is reported separately.
+
+    python tools/bench_fleet.py [--sites 300] [--batteries 2] [--seconds 15] [--real-drivers]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.fleet import FleetRuntime, Site, quiet_site_logging
+
+DRIVER_FILES = ("pymodbus", "async_venus_battery", "async_homewizard_p1_meter", "asyncio")
+
+
+class FakeAsyncBattery:
+    def __init__(self, name: str, latency: float):
+        self.name = name
+        self.latency = latency
+        self.soc = random.uniform(20, 80)
+        self.power = 0
+        self.drift_events = 0
+
+    async def read_state(self):
+        await asyncio.sleep(self.latency)
+        return round(self.soc, 1), self.power
+
+    async def read_energy(self):
+        await asyncio.sleep(self.latency)
+        return 0.0, 0.0
+
+    async def apply(self, control, command):
+        if command:
+            await asyncio.sleep(self.latency)
+            action, watts = command
+            self.power = -watts if action == "charge" else watts if action == "discharge" else 0
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncMeter:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.last_update = None
+
+    async def get_net_power(self):
+        await asyncio.sleep(self.latency)
+        self.last_update = time.time()
+        return random.randint(-3000, 3000)
+
+
+async def modbus_stub(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Minimal Modbus TCP server: holding register reads (3) and single writes (6), one register map per connection."""
+    registers = {32104: random.randint(20, 80)}
+    try:
+        while True:
+            transaction, _, length, unit = struct.unpack("!HHHB", await reader.readexactly(7))
+            pdu = await reader.readexactly(length - 1)
+            function = pdu[0]
+            if function == 3:
+                address, count = struct.unpack("!HH", pdu[1:5])
+                values = [registers.get(address + i, 0) for i in range(count)]
+                response = struct.pack("!BB", 3, 2 * count) + struct.pack(f"!{count}H", *values)
+            elif function == 6:
+                address, value = struct.unpack("!HH", pdu[1:5])
+                registers[address] = value
+                response = pdu[:5]
+            else:
+                response = struct.pack("!BB", function | 0x80, 1)
+            writer.write(struct.pack("!HHHB", transaction, 0, len(response) + 1, unit) + response)
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        pass  # client gone or benchmark finished
+    finally:
+        writer.close()
+
+
+async def p1_stub(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Minimal HomeWizard P1 API: answers every request with a random active_power_w."""
+    await reader.readuntil(b"\r\n\r\n")
+    body = json.dumps({"active_power_w": random.randint(-3000, 3000)}).encode()
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                 + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    writer.close()
+
+
+def build_sites(count: int, batteries: int, interval: float, latency: float,
+                modbus_port: int | None = None, p1_port: int | None = None) -> list[Site]:
+    sites = []
+    for i in range(count):
+        if modbus_port:
+            from batteries.async_venus_battery import AsyncVenusBattery
+            from meters.async_homewizard_p1_meter import AsyncHomeWizardP1Meter
+            meter = AsyncHomeWizardP1Meter(f"http://127.0.0.1:{p1_port}")
+            drivers = [AsyncVenusBattery("127.0.0.1", port=modbus_port, name=f"battery{j}") for j in range(batteries)]
+        else:
+            meter = FakeAsyncMeter(latency)
+            drivers = [FakeAsyncBattery(f"battery{j}", latency) for j in range(batteries)]
+        sites.append(Site(f"site{i}", meter, drivers, interval))
+    return sites
+
+
+async def measure_memory(args, modbus_port: int | None, p1_port: int | None) -> tuple[int, int, int]:
+    """Build and warm up a fleet under tracemalloc. Returns (site bytes, driver bytes, cycles)."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sites = build_sites(args.sites, args.batteries, args.interval, args.latency, modbus_port, p1_port)
+    fleet = FleetRuntime(sites, interval=args.interval)
+    # one full interval, so every site has connected and run a cycle
+    runner = asyncio.create_task(fleet.run(duration=args.interval * 1.5))
+    await asyncio.sleep(args.interval * 1.2)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    await runner
+
+    site_bytes = driver_bytes = 0
+    for stat in after.compare_to(before, "filename"):
+        filename = stat.traceback[0].filename
+        if any(part in filename for part in DRIVER_FILES):
+            driver_bytes += stat.size_diff
+        else:
+            site_bytes += stat.size_diff
+    return site_bytes, driver_bytes, fleet.cycles
+
+
+async def main(args) -> None:
+    modbus_port = p1_port = None
+    servers = []
+    if args.real_drivers:
+        servers.append(await asyncio.start_server(modbus_stub, "127.0.0.1", 0, backlog=4096))
+        servers.append(await asyncio.start_server(p1_stub, "127.0.0.1", 0, backlog=4096))
+        modbus_port = servers[0].sockets[0].getsockname()[1]
+        p1_port = servers[1].sockets[0].getsockname()[1]
+
+    site_bytes, driver_bytes, warmup_cycles = await measure_memory(args, modbus_port, p1_port)
+
+    # CPU is measured on a fresh fleet without tracemalloc slowing it down
+    sites = build_sites(args.sites, args.batteries, args.interval, args.latency, modbus_port, p1_port)
+    fleet = FleetRuntime(sites, interval=args.interval)
+    cpu = time.process_time()
+    await fleet.run(duration=args.seconds)
+    cpu = time.process_time() - cpu
+
+    for server in servers:
+        server.close()
+
+    kind = "real drivers against local stubs" if args.real_drivers else "fake drivers"
+    print(f"sites={args.sites} batteries/site={args.batteries} interval={args.interval}s ({kind})")
+    print(f"memory per site after warm-up ({warmup_cycles} cycles): "
+          f"{(site_bytes + driver_bytes) / args.sites / 1024:.1f} KiB "
+          f"(controller and site {site_bytes / args.sites / 1024:.1f} KiB, "
+          f"drivers and connections {driver_bytes / args.sites / 1024:.1f} KiB)")
+    print(f"site cycles: {fleet.cycles}, overruns: {fleet.overruns}, "
+          f"avg wall time per cycle {fleet.cycle_time / max(1, fleet.cycles) * 1000:.1f}ms")
+    print(f"CPU per site cycle: {cpu / max(1, fleet.cycles) * 1000:.3f}ms "
+          f"-> ~{args.interval / (cpu / max(1, fleet.cycles)):.0f} sites per core at this interval")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=300)
+    parser.add_argument("--batteries", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated round trip per request (s), fake drivers only")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--real-drivers", action="store_true",
+                        help="use AsyncVenusBattery and AsyncHomeWizardP1Meter against local stubs (needs pymodbus)")
+    args = parser.parse_args()
+    quiet_site_logging()
+    asyncio.run(main(args))
@@ -0,0 +1,119 @@
+"""
+Stress benchmark for the control loop jitter with and without process isolation.
+
+Runs a controller with a fake meter and fake batteries at a short interval
+while CPU-hungry sinks consume its snapshots, once with the sinks as threads
+in the control process (the default mode) and once with the sinks in a
+separate process fed through the shared-memory snapshot ring.
+
+    python tools/bench_jitter.py [--seconds 10] [--interval 0.02] [--sinks 2]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batteries.fake_battery import FakeBattery
+from core.controller import Controller
+from core.snapshot_ring import SnapshotRing, RemoteController
+from meters.fake_meter import FakeP1Meter
+from utils.logger import get_logger
+
+BATTERY_NAMES = ["FakeBattery1", "FakeBattery2", "FakeBattery3"]
+
+
+def build_controller(interval: float) -> Controller:
+    get_logger('Controller').setLevel(logging.WARNING)
+    batteries = [FakeBattery(name, initial_soc=50) for name in BATTERY_NAMES]
+    return Controller(meter=FakeP1Meter(start_power=800), batteries=batteries, interval_seconds=interval)
+
+
+def heavy_sink(snapshot: dict, work: int) -> None:
+    # stand-in for encoding and publishing: pure Python work holding the GIL
+    for _ in range(work):
+        json.loads(json.dumps(snapshot))
+
+
+def run_loop(controller: Controller, seconds: float) -> list[float]:
+    """Run the control loop and return the duration of every cycle."""
+    periods = []
+    last = time.perf_counter()
+    end = last + seconds
+    while last < end:
+        controller.run_once()
+        time.sleep(controller.interval)
+        now = time.perf_counter()
+        periods.append(now - last)
+        last = now
+    return periods
+
+
+def bench_single_process(seconds: float, interval: float, sinks: int, work: int) -> list[float]:
+    controller = build_controller(interval)
+    snapshots = queue.Queue(maxsize=1000)
+    controller.add_listener(lambda snapshot: snapshots.full() or snapshots.put(snapshot))
+
+    def consume():
+        while True:
+            heavy_sink(snapshots.get(), work)
+
+    for _ in range(sinks):
+        threading.Thread(target=consume, daemon=True).start()
+    return run_loop(controller, seconds)
+
+
+def _control_process(ring: SnapshotRing, seconds: float, interval: float, results) -> None:
+    controller = build_controller(interval)
+    controller.add_listener(ring.write)
+    results.put(run_loop(controller, seconds))
+
+
+def bench_multi_process(seconds: float, interval: float, sinks: int, work: int) -> list[float]:
+    ring = SnapshotRing(BATTERY_NAMES)
+    results = multiprocessing.get_context("fork").Queue()
+    process = multiprocessing.get_context("fork").Process(target=_control_process, args=(ring, seconds, interval, results))
+    process.start()
+
+    remote = RemoteController(ring, interval=interval, self_control_available=True, initial_mode=1)
+    snapshots = queue.Queue(maxsize=1000)
+    remote.add_listener(lambda snapshot: snapshots.full() or snapshots.put(snapshot))
+    remote.start()
+
+    def consume():
+        while True:
+            heavy_sink(snapshots.get(), work)
+
+    for _ in range(sinks):
+        threading.Thread(target=consume, daemon=True).start()
+    periods = results.get()
+    process.join()
+    remote.stop()
+    ring.close()
+    return periods
+
+
+def report(label: str, periods: list[float], interval: float) -> None:
+    jitter = sorted(abs(p - interval) * 1000 for p in periods)
+    p50 = jitter[len(jitter) // 2]
+    p99 = jitter[int(len(jitter) * 0.99)]
+    print(f"{label:<16} cycles={len(periods):<6} jitter p50={p50:6.2f}ms p99={p99:6.2f}ms max={jitter[-1]:6.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--sinks", type=int, default=2, help="number of sink threads")
+    parser.add_argument("--work", type=int, default=2000, help="encode/decode rounds per snapshot per sink")
+    args = parser.parse_args()
+
+    report("no sinks", bench_single_process(args.seconds, args.interval, 0, args.work), args.interval)
+    report("single process", bench_single_process(args.seconds, args.interval, args.sinks, args.work), args.interval)
+    report("multi process", bench_multi_process(args.seconds, args.interval, args.sinks, args.work), args.interval)